@@ -1,4 +1,13 @@
 from .settings import *
-from .storage import *
+from . import storage
+from .scanner import *
 from .tasks import *
 from .utils import *
+from .watcher import *
+
+
+def __getattr__(name):
+    # The storages are imported on first use, see datatransfer.storage
+    if name in storage.BACKEND_MODULES:
+        return getattr(storage, name)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
@@ -0,0 +1,167 @@
+"""Scanner module - used to find the files that are new or have changed since
+they were last transferred"""
+
+import json
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds a directory's modified time must be older than the last scan before
+# it is trusted to show that nothing has changed, to allow for file systems
+# that only store modified times to the second.
+DIR_SIGNATURE_GRACE = 2
+
+
+class IncrementalScanner:
+    """Keeps a snapshot of the files that have been transferred so that each
+    poll only returns files that are new or have changed since.
+
+    Each file is recorded with the signature from the storage's
+    `iter_dir_stats()` (modified time and size, or ETag and last modified for
+    S3) once it has been transferred. Files that haven't been transferred, or
+    whose signature has changed, are returned by `scan()`.
+
+    For storages with a `dir_signature()`, the directory isn't listed at all
+    if it hasn't changed since the last scan and nothing was left to do. As a
+    directory's signature only changes when files are added or removed, it is
+    still listed every `full_scan_interval` seconds to pick up files changed
+    in place.
+
+    Parameters
+    ----------
+    state_file : str, optional
+        Path of a JSON file the snapshot is saved to, so that it survives a
+        restart. If not supplied the snapshot is only kept in memory.
+    full_scan_interval : int
+        Maximum number of seconds between listings of the directory.
+
+    """
+    def __init__(self, state_file=None, full_scan_interval=300):
+        self.state_file = state_file
+        self.full_scan_interval = full_scan_interval
+        self.seen = {}
+        self.dir_signature = None
+        self.scanned_at = None
+        self.pending = True
+        self.batch = {}
+        # Set when `seen` differs from the state file
+        self.modified = False
+        self.load()
+
+    def load(self):
+        """Loads the snapshot from the state file, if there is one."""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file) as state:
+                self.seen = json.load(state).get('seen', {})
+            LOGGER.debug('Scanner - Loaded {0} files from {1}'.format(
+                len(self.seen), self.state_file))
+        except (OSError, ValueError) as err:
+            LOGGER.warning('Scanner - Unable to load state file '
+                           + self.state_file + ' - ' + repr(err))
+
+    def save(self):
+        """Saves the snapshot to the state file, replacing it atomically."""
+        if not self.state_file:
+            return
+        temp_file = self.state_file + '.tmp'
+        try:
+            with open(temp_file, 'w') as state:
+                json.dump({'seen': self.seen}, state)
+            os.replace(temp_file, self.state_file)
+        except OSError as err:
+            LOGGER.error('Scanner - Unable to save state file '
+                         + self.state_file + ' - ' + repr(err))
+            raise
+
+    def scan(self, storage, limit=None):
+        """Finds the files in the storage that are new or have changed since
+        they were last committed.
+
+        Parameters
+        ----------
+        storage : :obj:
+            The storage to scan.
+        limit : int, optional
+            Maximum number of files to return.
+
+        Returns
+        -------
+        :obj:`list` of `str`
+            The names of the new or changed files.
+
+        """
+        dir_signature = storage.dir_signature()
+        if (not self.pending and dir_signature is not None
+                and dir_signature == self.dir_signature
+                and dir_signature < self.scanned_at - DIR_SIGNATURE_GRACE
+                and time.time() - self.scanned_at < self.full_scan_interval):
+            LOGGER.debug('Scanner - Directory unchanged since last scan')
+            return []
+
+        scanned_at = time.time()
+        current = {}
+        changed = []
+        for file_name, signature in storage.iter_dir_stats():
+            current[file_name] = list(signature)
+            if self.seen.get(file_name) != current[file_name]:
+                changed.append(file_name)
+
+        # Forget files that have gone, so they are transferred if they return
+        seen = {file_name: signature for file_name, signature in self.seen.items()
+                if file_name in current}
+        if len(seen) != len(self.seen):
+            self.seen = seen
+            self.modified = True
+        batch = changed[:limit] if limit else changed
+        self.batch = {file_name: current[file_name] for file_name in batch}
+        self.pending = len(batch) < len(changed)
+        self.dir_signature = dir_signature
+        self.scanned_at = scanned_at
+        LOGGER.debug('Scanner - {0} new or changed files of {1}'.format(
+            len(changed), len(current)))
+        return batch
+
+    def track(self, storage, file_names):
+        """Adds files that were found without a scan, such as by watching
+        the directory, to the batch so that they can be committed.
+
+        Parameters
+        ----------
+        storage : :obj:
+            The storage holding the files.
+        file_names : :obj:`list` of `str`
+            The names of the files about to be transferred.
+
+        """
+        if hasattr(storage, 'file_stats'):
+            stats = storage.file_stats(file_names)
+        else:
+            wanted = set(file_names)
+            stats = ((file_name, signature) for file_name, signature
+                     in storage.iter_dir_stats() if file_name in wanted)
+        self.batch = {file_name: list(signature) for file_name, signature in stats}
+
+    def commit(self, file_names):
+        """Records files from the last scan as transferred. Any file from the
+        scan that isn't committed is returned again by the next scan.
+
+        Parameters
+        ----------
+        file_names : :obj:`list` of `str`
+            The names of the files that were transferred.
+
+        """
+        for file_name in file_names:
+            if file_name in self.batch:
+                self.seen[file_name] = self.batch.pop(file_name)
+                self.modified = True
+        if self.batch:
+            self.pending = True
+        self.batch = {}
+        if self.modified:
+            self.save()
+            self.modified = False
@@ -32,6 +32,7 @@ READ_AWS_S3_BUCKET_NAME = os.environ.get('READ_AWS_S3_BUCKET_NAME', 'aws-ingest'
 READ_AWS_S3_HOST = os.environ.get('READ_AWS_S3_HOST', 'http://s3server:8000')
 READ_AWS_S3_REGION = os.environ.get('READ_AWS_S3_REGION', 'eu-west-2')
 READ_AWS_S3_ENCRYPT = os.environ.get('READ_AWS_S3_ENCRYPT', False)
+READ_AWS_S3_RESUME_LISTING = os.environ.get('READ_AWS_S3_RESUME_LISTING', 'False')
 
 WRITE_AWS_ACCESS_KEY_ID = os.environ.get('WRITE_AWS_ACCESS_KEY_ID', 'accessKey1')
 WRITE_AWS_SECRET_ACCESS_KEY = os.environ.get('WRITE_AWS_SECRET_ACCESS_KEY', 'verySecretKey1')
@@ -40,6 +41,24 @@ WRITE_AWS_S3_HOST = os.environ.get('WRITE_AWS_S3_HOST', 'http://s3server:8000')
 WRITE_AWS_S3_REGION = os.environ.get('WRITE_AWS_S3_REGION', 'eu-west-2')
 WRITE_AWS_S3_ENCRYPT = os.environ.get('WRITE_AWS_S3_ENCRYPT', False)
 
+# S3 transfer tuning, shared by the read and write buckets. Objects larger than
+# the threshold are transferred in parts of the chunk size, with up to
+# max concurrency parts in flight.
+AWS_S3_MULTIPART_THRESHOLD = int(os.environ.get('AWS_S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+AWS_S3_MULTIPART_CHUNKSIZE = int(os.environ.get('AWS_S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))
+AWS_S3_MAX_CONCURRENCY = int(os.environ.get('AWS_S3_MAX_CONCURRENCY', 10))
+
+# sFTP transfer tuning, shared by the read and write servers. The window is how
+# many bytes the server may send before waiting for us, and the buffer is how
+# many bytes are read or written in each request.
+SFTP_WINDOW_SIZE = int(os.environ.get('SFTP_WINDOW_SIZE', 8 * 1024 * 1024))
+SFTP_MAX_PACKET_SIZE = int(os.environ.get('SFTP_MAX_PACKET_SIZE', 32 * 1024))
+SFTP_BUFFER_SIZE = int(os.environ.get('SFTP_BUFFER_SIZE', 32 * 1024))
+# Bytes requested ahead of the reader when streaming a file from sFTP.
+SFTP_READAHEAD_SIZE = int(os.environ.get('SFTP_READAHEAD_SIZE', 32 * SFTP_BUFFER_SIZE))
+#Number of sFTP channels that share each SSH connection to a server.
+SFTP_CHANNELS = int(os.environ.get('SFTP_CHANNELS', 4))
+
 READ_REDIS_HOST = os.environ.get('READ_REDIS_HOST', 'localhost')
 READ_REDIS_PORT = os.environ.get('READ_REDIS_PORT', '6379')
 READ_REDIS_PASSWORD = os.environ.get('READ_REDIS_PASSWORD', None)
@@ -51,6 +70,8 @@ READ_MQ_PATH = os.environ.get('READ_MQ_PATH', 'a_path')
 READ_MQ_USERNAME = os.environ.get('READ_MQ_USERNAME', None)
 READ_MQ_PASSWORD = os.environ.get('READ_MQ_PASSWORD', None)
 READ_MQ_REPUBLISH_QUEUE = os.environ.get('READ_MQ_REPUBLISH_QUEUE', None)
+READ_MQ_WORKERS = int(os.environ.get('READ_MQ_WORKERS', 1))
+READ_MQ_PREFETCH_COUNT = int(os.environ.get('READ_MQ_PREFETCH_COUNT', 0))
 
 WRITE_MQ = os.environ.get('WRITE_MQ', "False")
 WRITE_MQ_HOST = os.environ.get('WRITE_MQ_HOST', 'rabbitmq')
@@ -58,6 +79,8 @@ WRITE_MQ_PORT = os.environ.get('WRITE_MQ_PORT', '5672')
 WRITE_MQ_PATH = os.environ.get('WRITE_MQ_PATH', 'a_path')
 WRITE_MQ_USERNAME = os.environ.get('WRITE_MQ_USERNAME', None)
 WRITE_MQ_PASSWORD = os.environ.get('WRITE_MQ_PASSWORD', None)
+#Number of events published to the broker in each transaction.
+MQ_PUBLISH_WINDOW = int(os.environ.get('MQ_PUBLISH_WINDOW', 100))
 
 
 WRITE_REDIS_HOST = os.environ.get('WRITE_REDIS_HOST', 'localhost')
@@ -67,13 +90,27 @@ WRITE_REDIS_PASSWORD = os.environ.get('WRITE_REDIS_PASSWORD', None)
 #Max number of files to process at a time.
 MAX_FILES_BATCH = int(os.environ.get('MAX_FILES_BATCH', 25))
 PROCESS_INTERVAL = int(os.environ.get('PROCESS_INTERVAL', 5))
+#Watch a local source folder with inotify instead of polling it, listing it
+#every reconcile interval seconds to pick up anything missed.
+WATCH_SOURCE = os.environ.get('WATCH_SOURCE', 'False')
+WATCH_INTERVAL = int(os.environ.get('WATCH_INTERVAL', 60))
+#Number of threads used to transfer a batch of files concurrently.
+TRANSFER_WORKERS = int(os.environ.get('TRANSFER_WORKERS', 1))
+#Connections kept open to each S3 endpoint, shared by every transfer worker.
+AWS_S3_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_S3_MAX_POOL_CONNECTIONS',
+                                                 TRANSFER_WORKERS * AWS_S3_MAX_CONCURRENCY))
 FOLDER_DATE_OUTPUT = os.environ.get('FOLDER_DATE_OUTPUT', 'False')
+#Only transfer files that are new or changed since the last poll.
+INCREMENTAL_SCAN = os.environ.get('INCREMENTAL_SCAN', 'False')
+SCAN_STATE_FILE = os.environ.get('SCAN_STATE_FILE', None)
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
 LOG_FILE_NAME = os.environ.get('LOG_FILE_NAME', 'data-transfer-app.log')
 USE_IAM_CREDS = os.environ.get('USE_IAM_CREDS', 'False')
 TMP_FOLDER_NAME = os.environ.get('TEMP_FOLDER_NAME', 'tmp')
 COPY_FILES = os.environ.get('COPY_FILES', 'False')
 MAX_RETRIES = os.environ.get('MAX_RETRIES', '10')
+#Size in bytes of each chunk copied when streaming a file between storages.
+TRANSFER_CHUNK_SIZE = int(os.environ.get('TRANSFER_CHUNK_SIZE', 1024 * 1024))
 
 #  Loggin config
 DICTLOGCONFIG = {
@@ -0,0 +1,130 @@
+"""Storage package - each storage type is in its own module, which is only
+imported the first time one of its names is used. That way only the libraries
+for the configured storages (boto3, paramiko, redis, pika) are loaded, and
+`datatransfer.storage.SftpStorage` style names keep working."""
+
+import importlib
+import logging
+import threading
+from datatransfer import settings
+from datatransfer import utils
+
+LOGGER = logging.getLogger(__name__)
+
+# The module defining each public name in the package.
+BACKEND_MODULES = {
+    'FolderStorage': 'folder_storage',
+    'SFTP_KNOWN_DIRS': 'sftp_storage',
+    'SFTP_HOME_DIRS': 'sftp_storage',
+    'SFTP_TRANSPORTS': 'sftp_storage',
+    'SFTP_TRANSPORTS_LOCK': 'sftp_storage',
+    'open_sftp_channel': 'sftp_storage',
+    'release_sftp_slot': 'sftp_storage',
+    'close_sftp_channel': 'sftp_storage',
+    'SftpReadaheadReader': 'sftp_storage',
+    'SftpStorage': 'sftp_storage',
+    'S3_RESOURCES': 's3_storage',
+    'S3_RESOURCES_LOCK': 's3_storage',
+    'S3_DELETE_BATCH_SIZE': 's3_storage',
+    'get_s3_key': 's3_storage',
+    'get_s3_resource': 's3_storage',
+    'get_bucket': 's3_storage',
+    'S3RangedReader': 's3_storage',
+    'S3Storage': 's3_storage',
+    'REDIS_ADD_FILE_SCRIPT': 'redis_storage',
+    'RedisStorage': 'redis_storage',
+    'MessageQueue': 'message_queue',
+    'ThreadSafeChannel': 'message_queue',
+    'create_mq': 'message_queue',
+}
+
+
+def __getattr__(name):
+    """Imports the module defining `name` on first use."""
+    module_name = BACKEND_MODULES.get(name)
+    if module_name is None:
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('.' + module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(BACKEND_MODULES))
+
+
+class StorageBackend:
+    """A storage type resolved from the settings, used to create storages of
+    that type.
+
+    The storage class declares the conf it needs in `SETTINGS`, mapping each
+    conf key to the name of the setting holding it, so a new storage type
+    only needs a class with a `SETTINGS` schema to be configured. The conf is
+    read from the settings once, and the class is used as the factory. Its
+    connections are shared between storages with the same details, see
+    `open_sftp_channel` and `get_s3_resource`.
+
+    Parameters
+    ----------
+    storage_type : str
+        The import path of the storage class, e.g.
+        'datatransfer.storage.SftpStorage'.
+    prefix : str
+        'READ' or 'WRITE', for the settings to use.
+
+    """
+    def __init__(self, storage_type, prefix):
+        self.storage_class = utils.my_import(storage_type)
+        self.name = self.storage_class.__name__
+        # Settings that aren't defined for the prefix are left as None
+        self.conf = {key: getattr(settings, name.format(prefix), None)
+                     for key, name in self.storage_class.SETTINGS.items()}
+        # Storages that write to a temp folder and move the files out of it
+        self.uses_temp_folder = hasattr(self.storage_class, 'move_files')
+        # Storages that can write a batch of filenames without reading files
+        self.writes_file_names = hasattr(self.storage_class, 'write_files')
+        LOGGER.debug('Storage - {0} storage type set to {1}'.format(prefix, self.name))
+
+    def create(self, path):
+        """Creates a storage for a path.
+
+        Parameters
+        ----------
+        path : str
+            The path the storage should use.
+
+        Returns
+        -------
+        obj:
+            The storage object for the path.
+
+        """
+        return self.storage_class(dict(self.conf, path=path))
+
+
+# Storage backends that have been resolved, keyed by (storage_type, prefix).
+BACKENDS = {}
+BACKENDS_LOCK = threading.Lock()
+
+
+def get_backend(storage_type, prefix):
+    """Gets the backend for a storage type, resolving it on first use.
+
+    Parameters
+    ----------
+    storage_type : str
+        The import path of the storage class.
+    prefix : str
+        'READ' or 'WRITE', for the settings to use.
+
+    Returns
+    -------
+    obj:
+        The StorageBackend for the storage type.
+
+    """
+    key = (storage_type, prefix)
+    with BACKENDS_LOCK:
+        if key not in BACKENDS:
+            BACKENDS[key] = StorageBackend(storage_type, prefix)
+        return BACKENDS[key]
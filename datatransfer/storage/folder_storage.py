@@ -0,0 +1,438 @@
+"""Folder storage module - stores files in a local directory"""
+
+import errno
+import logging
+import shutil
+import os
+from datatransfer import settings
+from datatransfer import utils
+
+LOGGER = logging.getLogger(__name__)
+
+class FolderStorage:
+    """Abstraction for using a local directory for storage.
+
+    Can list the contents of the directory and supports read, write and delete
+    operations on files within the directory.
+
+    Parameters
+    ----------
+    conf : dict of `str`: `str`
+        Used to provide the `path` for the directory.
+
+    """
+    # The conf keys read from the settings, other than `path`. Setting names
+    # are formatted with the READ or WRITE prefix.
+    SETTINGS = {}
+
+    def __init__(self, conf):
+        self.path = conf.get('path')
+        os.makedirs(self.path, exist_ok=True)
+        LOGGER.debug('Folder - Set storage type to Folder')
+        LOGGER.debug('Folder - Path: ' + self.path)
+
+    def list_dir(self):
+        """Lists the contents of the directory.
+
+        Returns
+        -------
+        :obj:`list` of `str`
+            A list of all files in the directory.
+
+        """
+        return list(self.iter_dir())
+
+    def iter_dir(self, limit=None):
+        """Iterates over the files in the directory, reading the directory
+        lazily so that it stops once `limit` files have been found.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Maximum number of files to return.
+
+        Returns
+        -------
+        iterator of `str`
+            The names of the files in the directory.
+
+        """
+        LOGGER.debug('Folder - List contents of folder directory')
+        count = 0
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if limit and count >= limit:
+                        return
+                    if entry.is_file():
+                        count += 1
+                        yield entry.name
+        except OSError:
+            LOGGER.error('Folder - Error trying to read path ' + self.path)
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    def iter_dir_stats(self):
+        """Iterates over the files in the directory along with a signature
+        that changes whenever the file does.
+
+        Returns
+        -------
+        iterator of (`str`, tuple)
+            The name of each file and its modified time and size.
+
+        """
+        LOGGER.debug('Folder - List contents and stats of folder directory')
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stats = entry.stat()
+                        yield entry.name, (stats.st_mtime_ns, stats.st_size)
+        except OSError:
+            LOGGER.error('Folder - Error trying to read path ' + self.path)
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    def file_stats(self, file_names):
+        """Gets the same signatures as `iter_dir_stats` for named files,
+        without listing the directory.
+
+        Parameters
+        ----------
+        file_names : :obj:`list` of `str`
+            Names of the files.
+
+        Returns
+        -------
+        iterator of (`str`, tuple)
+            The name of each file that exists and its modified time and size.
+
+        """
+        for file_name in file_names:
+            try:
+                stats = os.stat(os.path.join(self.path, file_name))
+            except FileNotFoundError:
+                continue
+            yield file_name, (stats.st_mtime_ns, stats.st_size)
+
+    def dir_signature(self):
+        """Gets the modified time of the directory, which changes whenever a
+        file is added to or removed from it.
+
+        Returns
+        -------
+        float
+            The modified time of the directory in seconds.
+
+        """
+        return os.stat(self.path).st_mtime
+
+    def read_file(self, file_name):
+        """Reads a specific file from the directory.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to read; including the file extension but not the
+            file's path.
+
+        Returns
+        -------
+        str
+            A string containing the contents of the file being read.
+
+        """
+        LOGGER.debug('Folder - Read file : ' + os.path.join(self.path, file_name))
+        try:
+            with open(os.path.join(self.path, file_name), 'rb') as file:
+                return file.read()
+        except OSError:
+            LOGGER.error(
+                'Folder - Error trying to read file ' + os.path.join(self.path, file_name))
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    def open_read(self, file_name):
+        """Opens a specific file from the directory for streaming.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to read; including the file extension but not the
+            file's path.
+
+        Returns
+        -------
+        :obj: file
+            A binary file object that the contents can be read from in chunks.
+
+        """
+        LOGGER.debug('Folder - Open file : ' + os.path.join(self.path, file_name))
+        try:
+            return open(os.path.join(self.path, file_name), 'rb')
+        except OSError:
+            LOGGER.error(
+                'Folder - Error trying to open file ' + os.path.join(self.path, file_name))
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    def write_file(self, file_name, content):
+        """Writes content to a file to the directory.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+        content : str
+            The content to be written to the file.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is successfully written.
+
+        """
+        LOGGER.debug('Folder - Write to file : ' + os.path.join(self.path, file_name))
+        try:
+            os.makedirs(self.path, exist_ok=True)
+
+            with open(os.path.join(self.path, file_name), 'w+b') as file:
+                file.write(content)
+
+            return True
+        except OSError as err:
+            LOGGER.error('Folder - Error trying to write file '
+                         + os.path.join(self.path, file_name) + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    def write_stream(self, file_name, file_obj):
+        """Writes the contents of a file object to a file in the directory,
+        copying it in chunks of `TRANSFER_CHUNK_SIZE` bytes.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+        file_obj : :obj: file
+            A binary file object to read the content from.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is successfully written.
+
+        """
+        LOGGER.debug('Folder - Stream to file : ' + os.path.join(self.path, file_name))
+        try:
+            os.makedirs(self.path, exist_ok=True)
+
+            with open(os.path.join(self.path, file_name), 'w+b') as file:
+                shutil.copyfileobj(file_obj, file, settings.TRANSFER_CHUNK_SIZE)
+
+            return True
+        except OSError as err:
+            LOGGER.error('Folder - Error trying to write file '
+                         + os.path.join(self.path, file_name) + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    def copy_from(self, source, file_name, keep_source=True):
+        """Copies a file from another local directory without reading it into
+        this process.
+
+        If both directories are on the same device and the source file is
+        going to be deleted, the file is hard linked so the data isn't copied
+        at all. Otherwise the copy is done in the kernel with
+        `copy_file_range` (or `sendfile` where that isn't available).
+
+        Parameters
+        ----------
+        source : :obj:
+            The storage the file is being copied from.
+        file_name : str
+            Name of the file to copy; including the file extension but not
+            the file's path.
+        keep_source : bool
+            False if the source file will be deleted after the copy.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is copied, or False if the source
+            isn't a local directory.
+
+        """
+        if not isinstance(source, FolderStorage):
+            return False
+
+        source_file = os.path.join(source.path, file_name)
+        dest_file = os.path.join(self.path, file_name)
+        LOGGER.debug('Folder - Copy file : ' + source_file + ' to ' + dest_file)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            if os.path.exists(dest_file):
+                os.remove(dest_file)
+
+            if not keep_source and os.stat(source.path).st_dev == os.stat(self.path).st_dev:
+                try:
+                    os.link(source_file, dest_file)
+                    return True
+                except OSError as err:
+                    # Some file systems don't support hard links
+                    LOGGER.debug('Folder - Unable to link file ' + repr(err))
+
+            self._copy_file(source_file, dest_file)
+            return True
+        except OSError as err:
+            LOGGER.error('Folder - Error trying to copy file ' + source_file
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    @staticmethod
+    def _copy_file(source_file, dest_file):
+        """Copies a file using `copy_file_range`, falling back to
+        `shutil.copyfile` if the kernel or file system doesn't support it."""
+        if hasattr(os, 'copy_file_range'):
+            with open(source_file, 'rb') as src, open(dest_file, 'wb') as dst:
+                remaining = os.fstat(src.fileno()).st_size
+                try:
+                    while remaining > 0:
+                        copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                    return
+                except OSError as err:
+                    if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                         errno.EOPNOTSUPP):
+                        raise
+        shutil.copyfile(source_file, dest_file)
+
+    def move_files(self, callback=None, file_names=None):
+        """Moves content from the tmp location to the target directory.
+
+        Parameters
+        ----------
+        callback : function, optional
+            Called with each file name once the file has been moved.
+        file_names : :obj:`list` of `str`, optional
+            Only move these files, leaving any others in the tmp location. The
+            tmp location isn't listed when they are supplied.
+
+        Returns
+        -------
+        bool
+            Returns True once the files have been moved.
+
+        """
+        LOGGER.debug('Folder - Move files : ' + self.path)
+        try:
+            source = self.path
+            dest = utils.chop_end_of_string(source, (os.sep + settings.TMP_FOLDER_NAME))
+            files = file_names if file_names is not None else os.listdir(source)
+
+            for filename in files:
+                LOGGER.debug('Folder - Trying to move file : '
+                             + os.path.join(self.path, filename) + ' to ' + dest)
+                # Atomic as tmp is within the target directory
+                os.replace(os.path.join(source, filename), os.path.join(dest, filename))
+                if callback is not None:
+                    callback(filename)
+
+            return True
+        except OSError:
+            LOGGER.error('Folder - Error trying to move files ' + self.path)
+            raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+
+    def delete_file(self, file_name):
+        """Deletes a file from the directory.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is successfully deleted.
+
+        """
+        LOGGER.debug('Folder - Delete file : ' + os.path.join(self.path, file_name))
+        try:
+            os.remove(os.path.join(self.path, file_name))
+            return True
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                LOGGER.warning('Folder - File for deletion was not found '
+                               + os.path.join(self.path, file_name))
+            else:
+                LOGGER.error('Folder - Error trying to delete file '
+                             + os.path.join(self.path, file_name))
+                raise
+        except Exception as err:
+            LOGGER.exception('Folder - Unexpected error ' + repr(err))
+            raise
+
+    def delete_files(self, file_names):
+        """Deletes a batch of files from the directory.
+
+        Parameters
+        ----------
+        file_names : :obj:`list` of `str`
+            Names of the files to delete.
+
+        Returns
+        -------
+        dict of `str`: `str`
+            The files that could not be deleted, mapped to the error.
+
+        """
+        LOGGER.debug('Folder - Delete {0} files : {1}'.format(len(file_names), self.path))
+        errors = {}
+        for file_name in file_names:
+            try:
+                os.remove(os.path.join(self.path, file_name))
+            except OSError as err:
+                LOGGER.error('Folder - Error deleting file ' + file_name
+                             + ' - ' + repr(err))
+                errors[file_name] = repr(err)
+        return errors
+
+    def is_connected(self):
+        """Checks whether the storage can still be used.
+
+        Returns
+        -------
+        bool
+            Returns True if the directory still exists.
+
+        """
+        return os.path.isdir(self.path)
+
+    def exit(self):
+        LOGGER.debug('Folder - Exit function')
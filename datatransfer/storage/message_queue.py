@@ -0,0 +1,360 @@
+"""Message queue module - publishes and consumes file events"""
+
+import concurrent.futures
+import functools
+import logging
+import threading
+import pika
+from datatransfer import settings
+from datatransfer import utils
+
+LOGGER = logging.getLogger(__name__)
+
+class MessageQueue:
+    """Abstraction for MQ interaction.
+    MessageQueue will allow for the publishing and consumption of event from a queue.
+    Currently MessageQueue only supports RabbitMQ
+
+    Parameters
+    ----------
+    conf: dict of 'str' : 'str'
+        Provides connection details for the message queue.
+    """
+    def __init__(self, conf, pika=pika):
+        LOGGER.debug('MessageQueue - Creating MessageQueue instance')
+        self.MAX_RETRIES = conf.get('max_retries')
+        self.publish_window = conf.get('publish_window', 100)
+        self._tx_channel = None
+        self._consumer_thread = None
+        self._executor = None
+        self._futures = set()
+        try:
+            if conf.get('username') is not None:
+                mq_credentials = pika.PlainCredentials(conf.get('username'), conf.get('password'))
+                self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=conf.get('host'),
+                                                                               port=conf.get('port'),
+                                                                               credentials=mq_credentials))
+            else:
+                self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=conf.get('host'),
+                                                                               port=int(conf.get('port'))))
+            self._channel = self.connection.channel()
+            self._channel.confirm_delivery()
+            LOGGER.debug('MessageQueue - Connection established')
+            self.queue_name = conf.get('queue_name')
+            self._channel.queue_declare(queue=conf.get('queue_name'), durable=True)
+            self._declared_queues = {self.queue_name}
+        except Exception as err:
+            LOGGER.exception('MessageQueue - Unexpected error ' + repr(err))
+            raise
+
+    def channel(self):
+        """Getter for _channel
+
+        Returns
+        -------
+        obj:
+            Pika connection channel object for queue interaction
+        """
+        return self._channel
+
+    def _create_queue(self, queue_name):
+        if queue_name not in self._declared_queues:
+            self.channel().queue_declare(queue=queue_name, durable=True)
+            self._declared_queues.add(queue_name)
+
+    def threadsafe(self, function, *args, **kwargs):
+        """Runs a function on the thread that is consuming from the connection.
+
+        Pika connections aren't thread safe, so when a worker thread needs to
+        use the channel the call is handed to the consuming thread and the
+        worker waits for the result. Outside of threaded consumption the
+        function is called directly.
+
+        Raises
+        ------
+        RuntimeError
+            If called from a worker once consumption has stopped.
+
+        Parameters
+        ----------
+        function: function
+            The function to call.
+
+        Returns
+        -------
+        obj:
+            The result of the function.
+        """
+        if threading.current_thread() is self._consumer_thread:
+            return function(*args, **kwargs)
+        if self._consumer_thread is None:
+            if self._executor is not None:
+                # A worker outlived consumption, nothing will run the call
+                raise RuntimeError('MessageQueue - Connection is no longer consuming')
+            return function(*args, **kwargs)
+
+        done = threading.Event()
+        result = {}
+
+        def run():
+            try:
+                result['value'] = function(*args, **kwargs)
+            except Exception as err:
+                result['error'] = err
+            finally:
+                done.set()
+
+        self.connection.add_callback_threadsafe(run)
+        while not done.wait(1):
+            if self._consumer_thread is None:
+                raise RuntimeError('MessageQueue - Connection is no longer consuming')
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def publish_event(self, file_name, queue_name=None):
+        """Publishes event to message queue.
+        Message delivery to the broker is confirmed or delivery is re-attempted
+        Parameters
+        ----------
+        file_name: str
+            A filename to be added to a queue.
+
+        Returns
+        -------
+        bool
+            returns True if event successfully published
+        """
+        return self.threadsafe(self._publish_event, file_name, queue_name)
+
+    def _publish_event(self, file_name, queue_name):
+        queue_name = queue_name if queue_name is not None else self.queue_name
+        self._create_queue(queue_name)
+        event = utils.generate_event(file_name)
+        msg_properties = pika.BasicProperties(delivery_mode=2)
+        nack_counter = 0
+        try:
+            while not self.channel().basic_publish(exchange='',
+                                                   routing_key=queue_name,
+                                                   body=event,
+                                                   properties=msg_properties):
+                # nack received, retry,
+                if nack_counter >= self.MAX_RETRIES:
+                    raise RuntimeError('Reached max retry count for event publication')
+                else:
+                    LOGGER.warning('MessageQueue - Failed to send message to broker')
+                    nack_counter += 1
+            return True
+        except Exception as err:
+            LOGGER.exception('MessageQueue - Unexpected error publishing event ' + repr(err))
+            raise
+
+    def tx_channel(self):
+        """Getter for the channel used to publish batches of events. The
+        channel is opened on first use in transaction mode, as confirm mode
+        can't be used on the same channel.
+
+        Returns
+        -------
+        obj:
+            Pika connection channel object for transactional publishing
+        """
+        if self._tx_channel is None:
+            self._tx_channel = self.connection.channel()
+            self._tx_channel.tx_select()
+        return self._tx_channel
+
+    def publish_events(self, file_names, queue_name=None):
+        """Publishes an event for each file name to the message queue.
+
+        Events are pipelined in windows of `publish_window` messages, each
+        committed as one transaction, so a window costs a single round trip to
+        the broker rather than one per event. A window that fails to commit is
+        republished, up to `MAX_RETRIES` times.
+
+        Delivery is at least once: if the connection drops after the broker
+        commits a window but before the commit is acknowledged, the whole
+        window is published again, so consumers must tolerate duplicates.
+
+        Parameters
+        ----------
+        file_names: iterable of str
+            Filenames to be added to a queue.
+
+        Returns
+        -------
+        int
+            The number of events published
+        """
+        queue_name = queue_name if queue_name is not None else self.queue_name
+        self._create_queue(queue_name)
+        msg_properties = pika.BasicProperties(delivery_mode=2)
+        published = 0
+        events = []
+        for file_name in file_names:
+            events.append(utils.generate_event(file_name))
+            if len(events) >= self.publish_window:
+                published += self._publish_window(events, queue_name, msg_properties)
+                events = []
+        if events:
+            published += self._publish_window(events, queue_name, msg_properties)
+        return published
+
+    def _publish_window(self, events, queue_name, msg_properties):
+        retry_counter = 0
+        while True:
+            try:
+                channel = self.tx_channel()
+                for event in events:
+                    channel.basic_publish(exchange='',
+                                          routing_key=queue_name,
+                                          body=event,
+                                          properties=msg_properties)
+                channel.tx_commit()
+                return len(events)
+            except Exception as err:
+                # A failed transaction closes the channel, so open a new one
+                self._tx_channel = None
+                if retry_counter >= self.MAX_RETRIES:
+                    LOGGER.exception('MessageQueue - Unexpected error publishing events '
+                                     + repr(err))
+                    raise RuntimeError('Reached max retry count for event publication')
+                LOGGER.warning('MessageQueue - Failed to commit events to broker '
+                               + repr(err))
+                retry_counter += 1
+
+    def consume(self, callback, prefetch_count=None, workers=None):
+        """Starts event consumption from configured queue
+
+        When `workers` is more than one, events are handed to a pool of worker
+        threads so that several are processed at once while this thread keeps
+        servicing the connection. The channel passed to the callback then
+        forwards its calls back to this thread. An event whose callback raises
+        is nacked without being requeued, so it is dropped or dead lettered
+        rather than redelivered forever.
+
+        Parameters
+        ----------
+        callback: function
+            Function to be called upon receiving event. Function must ack when
+            successful.
+        prefetch_count: int, optional
+            Maximum number of unacknowledged events delivered at once. Defaults
+            to the number of workers when consuming with workers.
+        workers: int, optional
+            Number of threads processing events.
+        """
+        try:
+            if workers is not None and workers > 1:
+                prefetch_count = prefetch_count or workers
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+                on_message = functools.partial(self._dispatch, callback)
+            else:
+                on_message = callback
+            if prefetch_count:
+                self.channel().basic_qos(prefetch_count=prefetch_count)
+            self._consumer_thread = threading.current_thread()
+            self.channel().basic_consume(on_message, queue=self.queue_name)
+            self.channel().start_consuming()
+        except Exception as err:
+            LOGGER.exception('MessageQueue - Unexepcted error consuming ' + repr(err))
+        finally:
+            if self._executor is not None:
+                self._finish_workers()
+            self._consumer_thread = None
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _finish_workers(self):
+        """Keeps servicing the connection until the events being processed
+        by worker threads are done, so that they can still be acked."""
+        while any(not future.done() for future in self._futures):
+            try:
+                self.connection.process_data_events(time_limit=0.1)
+            except Exception as err:
+                LOGGER.error('MessageQueue - Connection lost while finishing events '
+                             + repr(err))
+                break
+        self._futures.clear()
+
+    def _dispatch(self, callback, channel, method, properties, body):
+        future = self._executor.submit(self._run_callback, callback,
+                                       ThreadSafeChannel(self, channel), method,
+                                       properties, body)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def _run_callback(self, callback, channel, method, properties, body):
+        try:
+            callback(channel, method, properties, body)
+        except Exception as err:
+            LOGGER.exception('MessageQueue - Error processing event ' + repr(err))
+            try:
+                # Not requeued, as an event that fails is likely to fail again
+                # and would otherwise be redelivered in a tight loop.
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            except Exception as nack_err:
+                LOGGER.error('MessageQueue - Unable to nack event ' + repr(nack_err))
+
+    def exit(self):
+        self.connection.close()
+
+
+class ThreadSafeChannel:
+    """Wraps a pika channel so that its methods can be called from worker
+    threads. Each call is run on the thread consuming from the connection.
+
+    Parameters
+    ----------
+    mq: obj
+        The MessageQueue the channel belongs to.
+    channel: obj
+        The pika channel to wrap.
+    """
+    def __init__(self, mq, channel):
+        self._mq = mq
+        self._channel = channel
+
+    def __getattr__(self, name):
+        attr = getattr(self._channel, name)
+        if not callable(attr):
+            return attr
+        return functools.partial(self._mq.threadsafe, attr)
+
+
+def create_mq(read_write):
+    """Uses relevant conf settings to construct a MessageQueue
+    object.
+
+    Paramters
+    ---------
+    wear_write: str
+        Decides whether to use read or write settings
+
+    Returns
+    -------
+    obj:
+        MessageQueue object.
+    """
+    if read_write.capitalize() == 'Write':
+        conf = {'host': settings.WRITE_MQ_HOST,
+                'port': int(settings.WRITE_MQ_PORT),
+                'queue_name': settings.WRITE_MQ_PATH,
+                'max_retries': int(settings.MAX_RETRIES),
+                'publish_window': settings.MQ_PUBLISH_WINDOW}
+        if settings.WRITE_MQ_USERNAME is not None:
+            conf["username"] = settings.WRITE_MQ_USERNAME
+            conf["password"] = settings.WRITE_MQ_PASSWORD
+    elif read_write.capitalize() == "Read":
+        conf = {'host': settings.READ_MQ_HOST,
+                'port': int(settings.READ_MQ_PORT),
+                'queue_name': settings.READ_MQ_PATH,
+                'max_retries': int(settings.MAX_RETRIES),
+                'publish_window': settings.MQ_PUBLISH_WINDOW}
+        if settings.WRITE_MQ_USERNAME is not None:
+            conf["username"] = settings.READ_MQ_USERNAME
+            conf["password"] = settings.READ_MQ_PASSWORD
+    else:
+        raise ValueError('Incorrect value supplied for read_write')
+    return MessageQueue(conf)
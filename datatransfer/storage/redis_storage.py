@@ -0,0 +1,267 @@
+"""Redis storage module - records filenames in a redis list"""
+
+import logging
+import redis
+from datatransfer import settings
+
+LOGGER = logging.getLogger(__name__)
+
+# Pushes a filename onto the list (KEYS[1]) unless it is already there, using
+# the companion set (KEYS[2]) as the record of which names the list holds.
+REDIS_ADD_FILE_SCRIPT = """
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    return redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class RedisStorage:
+    """Abstraction for using a redis instance for storing and retrieving filenames
+    Used for storing, retrieving and listing filenames from a redis instance.
+
+    The filenames are held in a list at the configured key, with a companion
+    set at `<key>:members` used to de-duplicate writes. The set is trusted, so
+    anything else that removes filenames from the list must also remove them
+    from the set, or they won't be written again.
+
+    Parameters
+    ----------
+    conf : dict of 'str' : 'str'
+      used to provide connection information.
+    """
+    # The conf keys read from the settings, other than `path`. Setting names
+    # are formatted with the READ or WRITE prefix.
+    SETTINGS = {
+        'host': '{0}_REDIS_HOST',
+        'port': '{0}_REDIS_PORT',
+        'password': '{0}_REDIS_PASSWORD',
+    }
+
+    def __init__(self, conf, redis=redis):
+        LOGGER.debug('Redis - Set storage type to redis: ')
+        try:
+            self.redis = redis.Redis(
+                host = conf.get('host'),
+                port = conf.get('port'),
+                password = conf.get('password'))
+        except redis.ConnectionError as err:
+            LOGGER.error('Redis - Error connecting to redis server :' + ' - ' + repr(err))
+            raise
+        except redis.AuthenticationError as err:
+            LOGGER.error('Redis - Error authenticating to redis server :' + ' - ' + repr(err))
+            raise
+        self.path = conf.get('path')
+        self.set_key = self.path + ':members'
+        LOGGER.debug('Redis - Set redis key: ' + self.path)
+        self._add_file = self.redis.register_script(REDIS_ADD_FILE_SCRIPT)
+        self.migrate()
+
+    def migrate(self):
+        """Creates the companion set for a list key written before the set
+        was introduced, by adding every filename already in the list.
+        """
+        try:
+            if not self.redis.exists(self.set_key) and self.redis.exists(self.path):
+                LOGGER.info('Redis - Creating member set for redis key: ' + self.path)
+                file_names = self.redis.lrange(self.path, 0, -1)
+                for i in range(0, len(file_names), 1000):
+                    self.redis.sadd(self.set_key, *file_names[i:i + 1000])
+        except Exception as err:
+            LOGGER.exception('Redis - Unexpected error ' + repr(err))
+            raise
+
+    def list_dir(self):
+        """Lists contents of redis key.
+
+        Returns
+        -------
+        list: of b'str'
+            A list of all the filename for a configured redis key.
+
+        """
+        LOGGER.debug('Redis - List redis key contents: ' + self.path)
+        try:
+            return self.redis.lrange(self.path, 0, -1)
+        except Exception as err:
+            LOGGER.exception('Redis - Unexpected error ' + repr(err))
+            raise
+
+    def iter_dir(self, limit=None, page_size=1000):
+        """Iterates over the contents of the redis key, fetching it a page at
+        a time so that only the filenames used are transferred.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Maximum number of filenames to return.
+        page_size : int
+            Number of filenames fetched with each LRANGE.
+
+        Returns
+        -------
+        iterator: of b'str'
+            The filenames for the configured redis key.
+
+        """
+        LOGGER.debug('Redis - Iterate redis key contents: ' + self.path)
+        if limit:
+            page_size = min(limit, page_size)
+        start = 0
+        while True:
+            try:
+                page = self.redis.lrange(self.path, start, start + page_size - 1)
+            except Exception as err:
+                LOGGER.exception('Redis - Unexpected error ' + repr(err))
+                raise
+            for file_name in page:
+                if limit and start >= limit:
+                    return
+                start += 1
+                yield file_name
+            if len(page) < page_size:
+                return
+
+    def write_file(self, file_name, _content):
+        """Write a filename to a redis key.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write; including the file extension but not
+            the file's path.
+
+        Returns
+        -------
+        bool
+            returns True once the file is successfully written to redis.
+
+        """
+        LOGGER.debug('Redis - Write filename to redis key : ' + file_name)
+        try:
+            if self._add_file(keys=[self.path, self.set_key], args=[file_name]):
+                return True
+        except Exception as err:
+            LOGGER.exception('Redis - Unexpected error ' + repr(err))
+            raise
+
+    def write_files(self, file_names):
+        """Write a batch of filenames to a redis key in a single pipeline.
+
+        Parameters
+        ----------
+        file_names : :obj:`list` of `str`
+            Names of the files to write.
+
+        Returns
+        -------
+        :obj:`list` of `str`
+            The filenames that were added, leaving out any already in redis.
+
+        """
+        LOGGER.debug('Redis - Write {0} filenames to redis key : {1}'.format(
+            len(file_names), self.path))
+        try:
+            pipe = self.redis.pipeline()
+            for file_name in file_names:
+                self._add_file(keys=[self.path, self.set_key], args=[file_name],
+                               client=pipe)
+            added = pipe.execute()
+            return [file_name for file_name, count in zip(file_names, added) if count]
+        except Exception as err:
+            LOGGER.exception('Redis - Unexpected error ' + repr(err))
+            raise
+
+    def write_stream(self, file_name, _file_obj):
+        """Write a filename to a redis key. Only the name is stored so the
+        file object is not read.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write; including the file extension but not
+            the file's path.
+
+        Returns
+        -------
+        bool
+            returns True once the file is successfully written to redis.
+
+        """
+        return self.write_file(file_name, None)
+
+    def delete_file(self, file_name):
+        """Remove a filename from a redis key.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to remove
+
+        Returns
+        -------
+        bool
+            return True once file is successfully deleted from redis.
+
+        """
+        LOGGER.debug('Redis - Deleting filename from redis key : ' + file_name)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.lrem(self.path, file_name)
+            pipe.srem(self.set_key, file_name)
+            pipe.execute()
+            return True
+        except Exception as err:
+            LOGGER.exception('Redis - Unexpected error ' + repr(err))
+            raise
+
+    def is_connected(self):
+        """Checks whether the redis storage is still usable. The redis client
+        reconnects dropped pool connections itself, so no round trip is made.
+
+        Returns
+        -------
+        bool
+            Always returns True.
+
+        """
+        return True
+
+    def delete_files(self, file_names):
+        """Remove a batch of filenames from a redis key in a single
+        transaction.
+
+        Parameters
+        ----------
+        file_names : :obj:`list` of `str`
+            Names of the files to remove.
+
+        Returns
+        -------
+        dict of `str`: `str`
+            The filenames that could not be removed, mapped to the error.
+
+        """
+        LOGGER.debug('Redis - Deleting {0} filenames from redis key : {1}'.format(
+            len(file_names), self.path))
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            for file_name in file_names:
+                pipe.lrem(self.path, file_name)
+                pipe.srem(self.set_key, file_name)
+            results = pipe.execute(raise_on_error=False)
+        except Exception as err:
+            LOGGER.exception('Redis - Unexpected error ' + repr(err))
+            raise
+
+        errors = {}
+        for i, file_name in enumerate(file_names):
+            for result in results[i * 2:i * 2 + 2]:
+                if isinstance(result, Exception):
+                    LOGGER.error('Redis - Error deleting filename ' + repr(file_name)
+                                 + ' - ' + repr(result))
+                    errors[file_name] = repr(result)
+        return errors
+
+    def exit(self):
+        LOGGER.debug('Redis - Exit function')
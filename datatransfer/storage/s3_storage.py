@@ -0,0 +1,599 @@
+"""S3 storage module - stores files in an S3 bucket"""
+
+import collections
+import concurrent.futures
+import io
+import logging
+import threading
+import boto3
+from boto3.s3.transfer import TransferConfig
+import botocore
+from botocore.config import Config
+from datatransfer import settings
+from datatransfer import utils
+
+LOGGER = logging.getLogger(__name__)
+
+# S3 resources for each set of connection details, keyed by get_s3_key().
+# Only their clients are shared, as boto3 clients are thread safe but
+# resources are not.
+S3_RESOURCES = {}
+S3_RESOURCES_LOCK = threading.Lock()
+
+
+def get_s3_key(conf):
+    """Gets the connection details that an S3 client can be shared by.
+
+    Parameters
+    ----------
+    conf : dict of `str`: `str`
+        Used to provide S3 bucket connection details.
+
+    Returns
+    -------
+    tuple
+        The IAM mode, region, endpoint and credentials.
+
+    """
+    return (conf.get('USE_IAM_CREDS') == 'True', conf.get('AWS_S3_REGION'),
+            conf.get('AWS_S3_HOST'), conf.get('AWS_ACCESS_KEY_ID'),
+            conf.get('AWS_SECRET_ACCESS_KEY'))
+
+
+def get_s3_resource(conf):
+    """Gets an S3 resource service client; used to access S3 buckets.
+
+    The session and client are only created the first time they are needed
+    for a set of connection details, then shared by every later resource so
+    that their connection pool is reused.
+
+    Uses SSL to secure the connection.
+
+    Parameters
+    ----------
+    conf : dict of `str`: `str`
+        Used to provide S3 bucket connection details.
+
+    Returns
+    -------
+    :obj:
+        A reference to an S3 service resource, using the shared client.
+
+    """
+    key = get_s3_key(conf)
+    with S3_RESOURCES_LOCK:
+        resource = S3_RESOURCES.get(key)
+        if resource is None:
+            config = Config(max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS)
+            session = boto3.session.Session()
+            if key[0]:
+                LOGGER.info('S3 - AWS Credentials not supplied - will revert to IAM if available')
+                resource = session.resource('s3', config=config)
+            else:
+                resource = session.resource('s3', region_name=conf.get('AWS_S3_REGION'),
+                                            endpoint_url=conf.get('AWS_S3_HOST'),
+                                            aws_access_key_id=conf.get('AWS_ACCESS_KEY_ID'),
+                                            aws_secret_access_key=conf.get('AWS_SECRET_ACCESS_KEY'),
+                                            config=config)
+            S3_RESOURCES[key] = resource
+            LOGGER.debug('S3 - Created client for ' + str(conf.get('AWS_S3_HOST')))
+
+    return type(resource)(client=resource.meta.client)
+
+def get_bucket(bucket_name, conf):
+    """Gets an S3 bucket from an S3 service resource.
+
+    If the bucket doesn't already exist, then it is created.
+
+    Uses the resource service client (and session) that is created by
+    `get_s3_resource()`.
+
+    Parameters
+    ----------
+    bucket_name : str
+        The name of the S3 bucket to connect to.
+    conf : dict of `str`: `str`
+        Used to provide S3 bucket connection details.
+
+    Returns
+    -------
+    :obj:
+        A reference to an S3 bucket resource, accessible within the current
+        session.
+
+    """
+    s3resource = get_s3_resource(conf)
+    return s3resource.Bucket(bucket_name)
+
+class S3RangedReader(io.RawIOBase):
+    """Readable file object for an S3 object that downloads it in ranges.
+
+    While one range is being read the following ranges are fetched in
+    parallel, so at most `max_concurrency` + 1 ranges are held in memory.
+
+    Every range after the first is requested with the first range's ETag, so
+    if the object is overwritten during the download reading fails with a
+    `PreconditionFailed` error rather than mixing the two objects.
+
+    Parameters
+    ----------
+    s3_object : :obj:
+        The S3 object resource to read.
+    chunk_size : int
+        Size in bytes of each ranged GET.
+    max_concurrency : int
+        Number of ranges to fetch at the same time.
+
+    """
+    def __init__(self, s3_object, chunk_size, max_concurrency):
+        super().__init__()
+        self.s3_object = s3_object
+        self.chunk_size = chunk_size
+        self.pending = collections.deque()
+        self.executor = None
+        self.buffer = b''
+        self.position = 0
+
+        try:
+            response = s3_object.get(Range='bytes=0-{0}'.format(chunk_size - 1))
+        except botocore.exceptions.ClientError as err:
+            # Empty objects can't satisfy a range request
+            if err.response.get('Error', {}).get('Code') != 'InvalidRange':
+                raise
+            self.size = 0
+            self.offset = 0
+            return
+
+        self.buffer = response['Body'].read()
+        self.etag = response.get('ETag')
+        content_range = response.get('ContentRange')
+        self.size = int(content_range.split('/')[-1]) if content_range else len(self.buffer)
+        self.offset = len(self.buffer)
+        if self.offset < self.size:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_concurrency)
+            for _ in range(max_concurrency):
+                self._fetch_next()
+
+    def _fetch_range(self, start, end):
+        kwargs = {'IfMatch': self.etag} if self.etag else {}
+        response = self.s3_object.get(Range='bytes={0}-{1}'.format(start, end), **kwargs)
+        return response['Body'].read()
+
+    def _fetch_next(self):
+        if self.offset < self.size:
+            end = min(self.offset + self.chunk_size, self.size) - 1
+            self.pending.append(self.executor.submit(self._fetch_range, self.offset, end))
+            self.offset = end + 1
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while self.position >= len(self.buffer) and self.pending:
+            self.buffer = self.pending.popleft().result()
+            self.position = 0
+            self._fetch_next()
+
+        count = min(len(buf), len(self.buffer) - self.position)
+        buf[:count] = self.buffer[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def close(self):
+        if self.executor is not None:
+            for future in self.pending:
+                future.cancel()
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.pending.clear()
+        self.buffer = b''
+        super().close()
+
+
+# The most keys S3 accepts in a single delete_objects request.
+S3_DELETE_BATCH_SIZE = 1000
+
+
+class S3Storage:
+    """Abstraction for using an S3 bucket for storage.
+
+    Can list the contents of the S3 bucket and supports read, write and delete
+    operations on the S3 bucket. Note /TMP_FOLDER_NAME is removed from the path as the file
+    lock prevention is not required on S3.
+
+    Parameters
+    ----------
+    conf : dict of `str`: `str`
+        Used to provide the `path` and S3 bucket connection details.
+
+    """
+    # The conf keys read from the settings, other than `path`. Setting names
+    # are formatted with the READ or WRITE prefix.
+    SETTINGS = {
+        'AWS_S3_HOST': '{0}_AWS_S3_HOST',
+        'AWS_S3_BUCKET_NAME': '{0}_AWS_S3_BUCKET_NAME',
+        'AWS_ACCESS_KEY_ID': '{0}_AWS_ACCESS_KEY_ID',
+        'AWS_SECRET_ACCESS_KEY': '{0}_AWS_SECRET_ACCESS_KEY',
+        'AWS_S3_ENCRYPT': '{0}_AWS_S3_ENCRYPT',
+        'AWS_S3_REGION': '{0}_AWS_S3_REGION',
+        'AWS_S3_RESUME_LISTING': '{0}_AWS_S3_RESUME_LISTING',
+        'USE_IAM_CREDS': 'USE_IAM_CREDS',
+    }
+
+    def __init__(self, conf):
+        LOGGER.debug('S3 - Set storage type to S3 Bucket')
+        self.path = utils.chop_end_of_string(conf.get('path'), ('/' + settings.TMP_FOLDER_NAME))
+        self.bucket = get_bucket(conf.get('AWS_S3_BUCKET_NAME'), conf)
+        LOGGER.debug('S3 - Path: ' + self.path)
+        # Buckets opened with the same credentials can copy between each other
+        self.credentials = get_s3_key(conf)
+        # Key to continue listing after, when resuming listings between polls
+        self.resume_listing = conf.get('AWS_S3_RESUME_LISTING') == 'True'
+        self.start_after = None
+        self.transfer_conf = dict()
+        if conf.get('AWS_S3_ENCRYPT'):
+            self.transfer_conf.update(ServerSideEncryption=conf.get('AWS_S3_ENCRYPT'))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.AWS_S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.AWS_S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=settings.AWS_S3_MAX_CONCURRENCY)
+
+    def list_dir(self):
+        """Lists the contents of the S3 bucket.
+
+        Returns
+        -------
+        :obj:`list` of `str`
+            A list of all files in the S3 bucket.
+
+        """
+        return list(self.iter_dir())
+
+    def iter_dir(self, limit=None):
+        """Iterates over the files in the S3 bucket, requesting a page of keys
+        at a time so that it stops once `limit` files have been found.
+
+        Only the top level of the path is listed; keys in sub folders are
+        grouped by the server rather than returned.
+
+        If `AWS_S3_RESUME_LISTING` is set, a listing that stops at the limit
+        is continued from the last key returned the next time it is called,
+        so keys already seen aren't listed again. Once the end of the path
+        is reached the next listing starts from the beginning again.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Maximum number of files to return.
+
+        Returns
+        -------
+        iterator of `str`
+            The names of the files in the S3 bucket.
+
+        """
+        LOGGER.debug('S3 - List bucket contents: ' + self.path)
+        prefix = self.path + '/'
+        count = 0
+        try:
+            kwargs = {}
+            if self.resume_listing and self.start_after is not None:
+                LOGGER.debug('S3 - Continuing listing after: ' + self.start_after)
+                kwargs['StartAfter'] = self.start_after
+            paginator = self.bucket.meta.client.get_paginator('list_objects_v2')
+            pages = paginator.paginate(Bucket=self.bucket.name, Prefix=prefix,
+                                       Delimiter='/',
+                                       PaginationConfig={'PageSize': min(limit or 1000, 1000)},
+                                       **kwargs)
+            for page in pages:
+                for obj in page.get('Contents', []):
+                    file_name = obj['Key'][len(prefix):]
+                    if '/' not in file_name and file_name:
+                        if limit and count >= limit:
+                            return
+                        count += 1
+                        self.start_after = obj['Key']
+                        yield file_name
+            self.start_after = None
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error listing S3 directory ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def iter_dir_stats(self):
+        """Iterates over the files in the S3 bucket along with a signature
+        that changes whenever the file does.
+
+        Returns
+        -------
+        iterator of (`str`, tuple)
+            The name of each file and its ETag and last modified time.
+
+        """
+        LOGGER.debug('S3 - List bucket contents and stats: ' + self.path)
+        prefix = self.path + '/'
+        try:
+            paginator = self.bucket.meta.client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket.name, Prefix=prefix,
+                                           Delimiter='/'):
+                for obj in page.get('Contents', []):
+                    file_name = obj['Key'][len(prefix):]
+                    if '/' not in file_name and file_name:
+                        yield file_name, (obj['ETag'], str(obj['LastModified']))
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error listing S3 directory ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def dir_signature(self):
+        """S3 has no directory modified time, so the path is always listed.
+
+        Returns
+        -------
+        None
+
+        """
+        return None
+
+    def read_file(self, file_name):
+        """Reads a specific file from the S3 bucket.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to read; including the file extension but not the
+            file's path.
+
+        Returns
+        -------
+        str
+            A string containing the contents of the file being read.
+
+        """
+        LOGGER.debug('S3 - Read File : ' + self.path + '/' + file_name)
+        try:
+            file_obj = io.BytesIO()
+            self.bucket.download_fileobj(self.path + '/' + file_name, file_obj,
+                                         Config=self.transfer_config)
+            return file_obj.getvalue()
+
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error reading S3 file ' + file_name
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def open_read(self, file_name):
+        """Opens a specific file from the S3 bucket for streaming.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to read; including the file extension but not the
+            file's path.
+
+        Returns
+        -------
+        :obj: S3RangedReader
+            A file object that the contents can be read from in chunks. Large
+            objects are fetched using parallel ranged GETs.
+
+        """
+        LOGGER.debug('S3 - Open File : ' + self.path + '/' + file_name)
+        try:
+            return S3RangedReader(self.bucket.Object(self.path + '/' + file_name),
+                                  settings.AWS_S3_MULTIPART_CHUNKSIZE,
+                                  settings.AWS_S3_MAX_CONCURRENCY)
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error opening S3 file ' + file_name
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def write_file(self, file_name, content):
+        """Writes content to a file to the S3 bucket.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+        content : str
+            The content to be written to the file.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is successfully written.
+
+        """
+        LOGGER.debug('S3 - Write File : ' + self.path + '/' + file_name)
+        try:
+            self.bucket.upload_fileobj(io.BytesIO(content), self.path + '/' + file_name,
+                                       ExtraArgs=self.transfer_conf,
+                                       Config=self.transfer_config)
+            return True
+
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error writing to S3 directory : ' + file_name
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def write_stream(self, file_name, file_obj):
+        """Writes the contents of a file object to a file in the S3 bucket.
+        The upload is sent in parts so only a part is held in memory at once.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+        file_obj : :obj: file
+            A binary file object to read the content from.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is successfully written.
+
+        """
+        LOGGER.debug('S3 - Stream File : ' + self.path + '/' + file_name)
+        try:
+            self.bucket.upload_fileobj(file_obj, self.path + '/' + file_name,
+                                       ExtraArgs=self.transfer_conf,
+                                       Config=self.transfer_config)
+            return True
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error writing to S3 directory : ' + file_name
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def copy_from(self, source, file_name, keep_source=True):
+        """Copies a file from another S3 bucket without downloading it.
+
+        The copy is done server-side, using multipart copies for objects over
+        the multipart threshold. It is only possible when the source is also
+        an S3 storage reachable with the same credentials.
+
+        Parameters
+        ----------
+        source : :obj:
+            The storage the file is being copied from.
+        file_name : str
+            Name of the file to copy; including the file extension but not
+            the file's path.
+        keep_source : bool
+            Unused, the source object is left to be deleted by the caller.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is copied, or False if the source
+            can't be copied from server-side.
+
+        """
+        if not isinstance(source, S3Storage) or source.credentials != self.credentials:
+            return False
+
+        LOGGER.debug('S3 - Copy File : ' + source.bucket.name + '/' + source.path
+                     + '/' + file_name + ' to ' + self.path + '/' + file_name)
+        try:
+            self.bucket.copy({'Bucket': source.bucket.name,
+                              'Key': source.path + '/' + file_name},
+                             self.path + '/' + file_name,
+                             ExtraArgs=self.transfer_conf,
+                             Config=self.transfer_config)
+            return True
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error copying S3 file : ' + file_name
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def delete_file(self, file_name):
+        """Deletes a file from the S3 bucket.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to delete; including the file extension but not
+            the file's path.
+
+        Returns
+        -------
+        bool
+            returns True once the file is successfully deleted.
+
+        """
+        LOGGER.debug('S3 - Delete File : ' + self.path + '/' + file_name)
+        try:
+            self.bucket.delete_objects(
+                Delete={
+                    'Objects': [{
+                        'Key': self.path + '/' + file_name,
+                    }],
+                    'Quiet': True
+                }
+            )
+            return True
+        except botocore.exceptions.ClientError as err:
+            LOGGER.error('S3 - Error deleting file from S3 directory :' + file_name
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('S3 - Unexpected error ' + repr(err))
+            raise
+
+    def delete_files(self, file_names):
+        """Deletes a batch of files from the S3 bucket, with up to
+        `S3_DELETE_BATCH_SIZE` files in each request.
+
+        Parameters
+        ----------
+        file_names : :obj:`list` of `str`
+            Names of the files to delete.
+
+        Returns
+        -------
+        dict of `str`: `str`
+            The files that could not be deleted, mapped to the error.
+
+        """
+        LOGGER.debug('S3 - Delete {0} files : {1}'.format(len(file_names), self.path))
+        errors = {}
+        for i in range(0, len(file_names), S3_DELETE_BATCH_SIZE):
+            batch = file_names[i:i + S3_DELETE_BATCH_SIZE]
+            try:
+                response = self.bucket.delete_objects(
+                    Delete={
+                        'Objects': [{'Key': self.path + '/' + file_name}
+                                    for file_name in batch],
+                        'Quiet': True
+                    }
+                )
+            except botocore.exceptions.ClientError as err:
+                LOGGER.error('S3 - Error deleting files from S3 directory :'
+                             + self.path + ' - ' + repr(err))
+                errors.update((file_name, repr(err)) for file_name in batch)
+                continue
+            except Exception as err:
+                LOGGER.exception('S3 - Unexpected error ' + repr(err))
+                raise
+            for error in response.get('Errors', []):
+                file_name = error['Key'][len(self.path) + 1:]
+                LOGGER.error('S3 - Error deleting file from S3 directory :' + file_name
+                             + ' - ' + error.get('Code', '') + ' ' + error.get('Message', ''))
+                errors[file_name] = error.get('Code', '') + ': ' + error.get('Message', '')
+        return errors
+
+    def is_connected(self):
+        """Checks whether the S3 storage is still usable. boto3 manages its
+        own HTTP connection pool so there is nothing to re-establish.
+
+        Returns
+        -------
+        bool
+            Always returns True.
+
+        """
+        return True
+
+    def exit(self):
+        LOGGER.debug('S3 - Exit function')
@@ -0,0 +1,739 @@
+"""sFTP storage module - stores files on an sFTP server"""
+
+import collections
+import errno
+import io
+import logging
+import shutil
+import posixpath
+import stat
+import threading
+import paramiko
+from datatransfer import settings
+from datatransfer import utils
+
+LOGGER = logging.getLogger(__name__)
+
+# Directories known to exist on each sFTP server, keyed by (host, port, user),
+# so that each is only checked or created once per process.
+SFTP_KNOWN_DIRS = collections.defaultdict(set)
+# The login directory on each sFTP server, which storage paths are relative to.
+SFTP_HOME_DIRS = {}
+# Authenticated transports to each sFTP server, keyed by (host, port, user).
+# Each is a [transport, channels, limit, connected] list, where channels is the
+# number of storages with an sFTP channel open or being opened over the
+# transport, limit is the most it takes and connected is an Event set once
+# the transport has connected. The transport is None until then.
+SFTP_TRANSPORTS = collections.defaultdict(list)
+# Only held while updating SFTP_TRANSPORTS, never while talking to a server.
+SFTP_TRANSPORTS_LOCK = threading.Lock()
+
+
+def open_sftp_channel(server, conf, paramiko=paramiko):
+    """Opens an sFTP channel to a server, sharing an authenticated transport
+    with up to `SFTP_CHANNELS` other channels rather than connecting again.
+
+    A slot on a transport is reserved while holding the lock, and the
+    connection and channel are then opened without it, so a slow or
+    unreachable server doesn't hold up storages for any other server.
+    Storages that reserve a slot on a transport that is still connecting
+    wait for it to connect.
+
+    Parameters
+    ----------
+    server : tuple
+        The (host, port, user) the transport is shared by.
+    conf : dict of `str`: `str`
+        Used to provide the sFTP server connection details.
+
+    Returns
+    -------
+    tuple
+        The transport and the paramiko SFTPClient for the new channel.
+
+    """
+    with SFTP_TRANSPORTS_LOCK:
+        transports = SFTP_TRANSPORTS[server]
+        transports[:] = [entry for entry in transports
+                         if entry[0] is None or entry[0].is_active()]
+        entry = next((entry for entry in transports if entry[1] < entry[2]), None)
+        connect = entry is None
+        if connect:
+            entry = [None, 0, settings.SFTP_CHANNELS, threading.Event()]
+            transports.append(entry)
+            LOGGER.debug('sFTP - Opening transport {0} to {1}'.format(
+                len(transports), server[0]))
+        entry[1] += 1
+
+    if connect:
+        try:
+            entry[0] = SftpStorage.get_sftp_transport(conf, paramiko)
+        except Exception:
+            with SFTP_TRANSPORTS_LOCK:
+                if entry in transports:
+                    transports.remove(entry)
+            raise
+        finally:
+            entry[3].set()
+    else:
+        entry[3].wait()
+        if entry[0] is None:
+            # The connection this was waiting on failed, so try again
+            return open_sftp_channel(server, conf, paramiko)
+
+    try:
+        sftp = paramiko.SFTPClient.from_transport(
+            entry[0], window_size=settings.SFTP_WINDOW_SIZE,
+            max_packet_size=settings.SFTP_MAX_PACKET_SIZE)
+    except paramiko.SSHException as err:
+        # The server limits the sessions per connection
+        release_sftp_slot(server, entry, full=True)
+        if connect:
+            raise
+        LOGGER.warning('sFTP - Unable to open another channel ' + repr(err))
+        return open_sftp_channel(server, conf, paramiko)
+    except Exception:
+        release_sftp_slot(server, entry)
+        raise
+    return entry[0], sftp
+
+
+def release_sftp_slot(server, entry, full=False):
+    """Releases a channel's slot on a shared transport, closing the
+    transport once no other channels are using it.
+
+    Parameters
+    ----------
+    server : tuple
+        The (host, port, user) the transport is shared by.
+    entry : list
+        The transport's entry in `SFTP_TRANSPORTS`.
+    full : bool
+        Stops any more channels being opened over the transport.
+
+    """
+    with SFTP_TRANSPORTS_LOCK:
+        entry[1] -= 1
+        if full:
+            entry[2] = entry[1]
+        if entry[1] > 0:
+            return
+        transports = SFTP_TRANSPORTS[server]
+        if entry in transports:
+            transports.remove(entry)
+    entry[0].close()
+
+
+def close_sftp_channel(server, transport, sftp):
+    """Closes an sFTP channel, closing its transport too once no other
+    channels are using it.
+
+    Parameters
+    ----------
+    server : tuple
+        The (host, port, user) the transport is shared by.
+    transport : :obj:
+        The transport the channel was opened over.
+    sftp : :obj:
+        The paramiko SFTPClient for the channel.
+
+    """
+    sftp.close()
+    with SFTP_TRANSPORTS_LOCK:
+        entry = next((entry for entry in SFTP_TRANSPORTS[server]
+                      if entry[0] is transport), None)
+    if entry is None:
+        transport.close()
+    else:
+        release_sftp_slot(server, entry)
+
+
+class SftpReadaheadReader(io.RawIOBase):
+    """Readable file object for a remote sFTP file that requests it a window
+    at a time.
+
+    Each window of `readahead` bytes is requested with a single `readv`, so
+    the reads in it are pipelined, and the next window is only requested
+    once the reader has reached it. At most one window is held in memory
+    however slowly the file is read.
+
+    Parameters
+    ----------
+    remote_file : :obj: SFTPFile
+        The open remote file to read.
+    chunk_size : int
+        Size in bytes of each read request.
+    readahead : int
+        Size in bytes of each window.
+
+    """
+    def __init__(self, remote_file, chunk_size, readahead):
+        super().__init__()
+        self.remote_file = remote_file
+        self.chunk_size = chunk_size
+        self.readahead = max(readahead, chunk_size)
+        self.size = remote_file.stat().st_size
+        self.offset = 0
+        self.chunks = iter(())
+        self.buffer = b''
+        self.position = 0
+
+    def _fetch_next(self):
+        end = min(self.offset + self.readahead, self.size)
+        self.chunks = self.remote_file.readv(
+            [(start, min(self.chunk_size, end - start))
+             for start in range(self.offset, end, self.chunk_size)])
+        self.offset = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while self.position >= len(self.buffer):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                if self.offset >= self.size:
+                    return 0
+                self._fetch_next()
+                continue
+            if not chunk:
+                # The file was truncated while it was being read
+                return 0
+            self.buffer = chunk
+            self.position = 0
+
+        count = min(len(buf), len(self.buffer) - self.position)
+        buf[:count] = self.buffer[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.remote_file.close()
+        self.buffer = b''
+        super().close()
+
+
+class SftpStorage:
+    """Abstraction for using an sFTP server for storage.
+
+    Can list the contents of the sFTP server and supports read, write and delete
+    operations on the sFTP server.
+
+    As part of initialising the storage it checks whether the desired storage
+    path exists, if it doesn't exist then the required directories are created.
+    A path that doesn't start with '/' is relative to the login directory.
+    Either way it is resolved to an absolute `remote_path` so that each
+    operation is a single request rather than changing into the directory
+    first.
+
+    Each storage has its own sFTP channel, but up to `SFTP_CHANNELS` storages
+    for the same server share one SSH connection, so that concurrent
+    transfers don't each need a handshake and login.
+
+    Parameters
+    ----------
+    conf : dict of `str`: `str`
+        Used to provide the `path` and sFTP server connection details.
+
+    """
+    # The conf keys read from the settings, other than `path`. Setting names
+    # are formatted with the READ or WRITE prefix.
+    SETTINGS = {
+        'FTP_HOST': '{0}_FTP_HOST',
+        'FTP_USER': '{0}_FTP_USER',
+        'FTP_PASSWORD': '{0}_FTP_PASSWORD',
+        'FTP_PORT': '{0}_FTP_PORT',
+    }
+
+    def __init__(self, conf, paramiko=paramiko):
+        LOGGER.debug('sFTP - Set storage type to Sftp')
+        self.path = conf.get('path')
+        LOGGER.debug('sFTP - Path: ' + self.path)
+        self.server = (conf.get('FTP_HOST'), str(conf.get('FTP_PORT')),
+                       conf.get('FTP_USER'))
+        self.sftp_session, self.sftp = open_sftp_channel(self.server, conf, paramiko)
+        self.known_dirs = SFTP_KNOWN_DIRS[self.server]
+        self.remote_path = self.check_dir_path(self.path.split('/'))
+
+    @staticmethod
+    def get_sftp_transport(conf, paramiko=paramiko):
+        """Takes the configuration for the sFTP and returns a client connection.
+
+        Creates the connection to the server. It will also look for the local
+        ssh keys and use them if they exist.
+
+        Parameters
+        ----------
+        conf : dict of `str`: `str`
+            Used to provide the `path` and FTP server connection details.
+
+
+        Returns
+        -------
+        :obj: sftp paramiko client
+            Returns a client connection to the sftp server.
+
+        """
+        transport = paramiko.Transport((conf.get('FTP_HOST'),
+                                        int(conf.get('FTP_PORT'))),
+                                       default_window_size=settings.SFTP_WINDOW_SIZE,
+                                       default_max_packet_size=settings.SFTP_MAX_PACKET_SIZE)
+        transport.connect(username=conf.get('FTP_USER'),
+                          password=conf.get('FTP_PASSWORD'))
+        return transport
+
+    def check_dir_exists(self, folder):
+        """Checks whether a directory exists on the sFTP server.
+
+        Parameters
+        ----------
+        folder : str
+            Path of the directory that is being checked for.
+
+        Returns
+        -------
+        bool
+            Returns True if the directory exists, False if it doesn't.
+
+        """
+        LOGGER.debug('sFTP - Checking directory exists : ' + folder)
+        try:
+            return stat.S_ISDIR(self.sftp.stat(folder).st_mode)
+        except FileNotFoundError:
+            return False
+        except IOError as err:
+            LOGGER.error('Error checking ftp directory ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def make_dirs(self, folder):
+        """Creates a directory and any missing parents on the sFTP server.
+
+        Directories already known to exist are skipped, so once the parents of
+        a path have been seen only the new directory is created.
+
+        Parameters
+        ----------
+        folder : str
+            Path of the directory to create.
+
+        """
+        if folder in self.known_dirs or self.check_dir_exists(folder):
+            self.known_dirs.add(folder)
+            return
+        parent = posixpath.dirname(folder)
+        if parent != folder:
+            self.make_dirs(parent)
+        LOGGER.debug('sFTP - Creating directory : ' + folder)
+        try:
+            self.sftp.mkdir(folder)
+        except IOError:
+            # Another worker may have created it first
+            if not self.check_dir_exists(folder):
+                raise
+        self.known_dirs.add(folder)
+
+    def get_home_dir(self):
+        """Gets the login directory on the sFTP server, only asking the server
+        once per process.
+
+        Returns
+        -------
+        str
+            The absolute path of the login directory.
+
+        """
+        home = SFTP_HOME_DIRS.get(self.server)
+        if home is None:
+            home = SFTP_HOME_DIRS[self.server] = self.sftp.normalize('.')
+            self.known_dirs.add(home)
+        return home
+
+    def check_dir_path(self, directory):
+        """Checks whether the directories in the path exist and if they don't
+        it creates them.
+
+        Parameters
+        ----------
+        directory : :obj:`list` of `str`
+            A list containing the elements of the directory path to check. A
+            path starting with '/' (first element empty) is absolute, any
+            other is relative to the login directory.
+
+        Returns
+        -------
+        str
+            The absolute path of the directory.
+
+        """
+        levels = [level for level in directory if level != '']
+        if directory and directory[0] == '':
+            folder = posixpath.join('/', *levels)
+        else:
+            folder = posixpath.join(self.get_home_dir(), *levels)
+        if folder not in self.known_dirs:
+            self.make_dirs(folder)
+        return folder
+
+    def remote_file(self, file_name):
+        """Gets the absolute path of a file in the storage directory."""
+        return self.remote_path + '/' + file_name
+
+    def open_write(self, file_name, mode='wb'):
+        """Opens a file in the storage directory for writing, creating the
+        directory again if it has been removed since it was checked.
+
+        Writes are pipelined, so each request is sent without waiting for the
+        server to acknowledge the last; any error is raised on close.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to.
+        mode : str
+            The mode to open the file in.
+
+        Returns
+        -------
+        :obj: SFTPFile
+            The remote file object.
+
+        """
+        try:
+            remote_file = self.sftp.open(self.remote_file(file_name), mode,
+                                         settings.SFTP_BUFFER_SIZE)
+        except FileNotFoundError:
+            # Forget what was known about the server and create it again
+            LOGGER.debug('sFTP - Directory has been removed : ' + self.remote_path)
+            self.known_dirs.clear()
+            self.make_dirs(self.remote_path)
+            remote_file = self.sftp.open(self.remote_file(file_name), mode,
+                                         settings.SFTP_BUFFER_SIZE)
+        remote_file.set_pipelined(True)
+        return remote_file
+
+    def list_dir(self):
+        """Lists the contents of the sFTP server.
+
+        Returns
+        -------
+        :obj:`list` of `str`
+            A list of all files in the sFTP server Excludes folders.
+
+        """
+        return list(self.iter_dir())
+
+    def iter_dir(self, limit=None):
+        """Iterates over the files on the sFTP server.
+
+        The directory is read with pipelined READDIR requests. The listing is
+        always read to the end, as abandoning it part way would leave
+        responses unread on the channel, but only `limit` names are returned.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Maximum number of files to return.
+
+        Returns
+        -------
+        iterator of `str`
+            The names of the files in the directory. Excludes folders.
+
+        """
+        LOGGER.debug('sFTP - List directory ' + self.path)
+        try:
+            file_list = [file.filename for file in self.sftp.listdir_iter(self.remote_path)
+                         if not stat.S_ISDIR(file.st_mode)]
+        except IOError as err:
+            LOGGER.error('sFTP - Error listing sftp directory contents' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+        return iter(file_list[:limit] if limit else file_list)
+
+    def iter_dir_stats(self):
+        """Iterates over the files on the sFTP server along with a signature
+        that changes whenever the file does.
+
+        Returns
+        -------
+        iterator of (`str`, tuple)
+            The name of each file and its modified time and size.
+
+        """
+        LOGGER.debug('sFTP - List directory and stats ' + self.path)
+        try:
+            return iter([(file.filename, (file.st_mtime, file.st_size))
+                         for file in self.sftp.listdir_iter(self.remote_path)
+                         if not stat.S_ISDIR(file.st_mode)])
+        except IOError as err:
+            LOGGER.error('sFTP - Error listing sftp directory contents' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def dir_signature(self):
+        """sFTP servers only report modified times to the second and their
+        clocks may differ from ours, so the directory is always listed.
+
+        Returns
+        -------
+        None
+
+        """
+        return None
+
+    def read_file(self, file_name):
+        """Reads a specific file from the sFTP server.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to read; including the file extension but not the
+            file's path.
+
+        Returns
+        -------
+        str
+            A string containing the contents of the file being read.
+
+        """
+        LOGGER.debug('sFTP - Read File : ' + self.path + '/' + file_name)
+        try:
+            with self.sftp.open(self.remote_file(file_name), 'rb',
+                                settings.SFTP_BUFFER_SIZE) as remote_file:
+                # The whole file is wanted, so request it all up front
+                remote_file.prefetch()
+                return remote_file.read()
+
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                LOGGER.error('sFTP - Error reading file from sftp server '
+                             + self.path + '/' + file_name + ' ' + repr(err))
+                raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def open_read(self, file_name):
+        """Opens a specific file on the sFTP server for streaming.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to read; including the file extension but not the
+            file's path.
+
+        Returns
+        -------
+        :obj: SftpReadaheadReader
+            A file object that the contents can be read from in chunks, with
+            up to SFTP_READAHEAD_SIZE bytes being requested ahead.
+
+        """
+        LOGGER.debug('sFTP - Open File : ' + self.path + '/' + file_name)
+        try:
+            remote_file = self.sftp.open(self.remote_file(file_name), 'rb',
+                                         settings.SFTP_BUFFER_SIZE)
+            try:
+                return SftpReadaheadReader(remote_file, settings.SFTP_BUFFER_SIZE,
+                                           settings.SFTP_READAHEAD_SIZE)
+            except Exception:
+                remote_file.close()
+                raise
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                LOGGER.warning('sFTP - File not found when opening sFTP '
+                               + self.path + '/' + file_name)
+            else:
+                LOGGER.error('sFTP - Error opening file from sftp server '
+                             + self.path + '/' + file_name + ' ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def move_files(self, callback=None, file_names=None):
+        """Moves content from the tmp location to the target directory.
+
+        Parameters
+        ----------
+        callback : function, optional
+            Called with each file name once the file has been moved.
+        file_names : :obj:`list` of `str`, optional
+            Only move these files, leaving any others in the tmp location. The
+            tmp location isn't listed when they are supplied.
+
+        Returns
+        -------
+        bool
+            Returns True once the files have been moved.
+
+        """
+        LOGGER.debug('sFTP - Move files : ' + self.path)
+        try:
+            source = self.remote_path
+            dest = utils.chop_end_of_string(source, '/' + settings.TMP_FOLDER_NAME)
+            files = file_names if file_names is not None else self.list_dir()
+            LOGGER.debug('sFTP - Destination folder : ' + dest)
+            for filename in files:
+                LOGGER.debug('sFTP - Trying to move file '
+                             + filename + ' to ' + dest)
+                LOGGER.debug('sFTP - Source filename ' + source + '/' + filename
+                             + ' Target filename ' + dest + '/' + filename)
+                self.sftp.posix_rename(source + '/' + filename, dest + '/'
+                                       + filename)
+                if callback is not None:
+                    callback(filename)
+
+            return True
+        except OSError as err:
+            LOGGER.error('sFTP - Error trying to move files ' + self.path
+                         + ' - ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def write_file(self, file_name, content):
+        """Writes content to a file to the sFTP server.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+        content : str
+            The content to be written to the file.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is successfully written.
+
+        """
+        LOGGER.debug('sFTP - Write File : ' + self.path + '/' + file_name)
+        try:
+            with self.open_write(file_name, 'w+') as file_obj:
+                file_obj.write(content)
+            return True
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                LOGGER.error('sFTP - (File not found) Error writing file to sftp server '
+                             + self.path + '/' + file_name)
+                raise
+            else:
+                LOGGER.error('sFTP - Error writing file to sftp server '
+                             + self.path + '/' + file_name + ' ' + repr(err))
+                raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def write_stream(self, file_name, file_obj):
+        """Writes the contents of a file object to a file on the sFTP
+        server, copying it in chunks of `TRANSFER_CHUNK_SIZE` bytes.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+        file_obj : :obj: file
+            A binary file object to read the content from.
+
+        Returns
+        -------
+        bool
+            Returns True once the file is successfully written.
+
+        """
+        LOGGER.debug('sFTP - Stream File : ' + self.path + '/' + file_name)
+        try:
+            with self.open_write(file_name) as remote_file:
+                shutil.copyfileobj(file_obj, remote_file, settings.TRANSFER_CHUNK_SIZE)
+            return True
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                LOGGER.error('sFTP - (File not found) Error writing file to sftp server '
+                             + self.path + '/' + file_name)
+            else:
+                LOGGER.error('sFTP - Error writing file to sftp server '
+                             + self.path + '/' + file_name + ' ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def delete_file(self, file_name):
+        """Deletes a file from the sFTP server.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file to write to; including the file extension but not
+            the file's path.
+
+        Returns
+        -------
+        bool
+            returns True once the file is successfully deleted.
+
+        """
+        LOGGER.debug('sFTP - Delete File : ' + self.path + '/' + file_name)
+        try:
+            self.sftp.remove(self.remote_file(file_name))
+            return True
+        except IOError as err:
+            LOGGER.error('sFTP - Error deleting file from ftp server '
+                         + self.path + '/' + file_name + ' ' + repr(err))
+            raise
+        except Exception as err:
+            LOGGER.exception('sFTP - Unexpected error ' + repr(err))
+            raise
+
+    def delete_files(self, file_names):
+        """Deletes a batch of files from the sFTP server.
+
+        Parameters
+        ----------
+        file_names : :obj:`list` of `str`
+            Names of the files to delete.
+
+        Returns
+        -------
+        dict of `str`: `str`
+            The files that could not be deleted, mapped to the error.
+
+        """
+        LOGGER.debug('sFTP - Delete {0} files : {1}'.format(len(file_names), self.path))
+        errors = {}
+        for file_name in file_names:
+            try:
+                self.sftp.remove(self.remote_file(file_name))
+            except IOError as err:
+                LOGGER.error('sFTP - Error deleting file from ftp server '
+                             + self.path + '/' + file_name + ' ' + repr(err))
+                errors[file_name] = repr(err)
+        return errors
+
+    def is_connected(self):
+        """Checks whether the sFTP connection is still usable.
+
+        Returns
+        -------
+        bool
+            Returns True if the underlying SSH transport is still active.
+
+        """
+        return self.sftp_session.is_active()
+
+    def exit(self):
+        LOGGER.info('sFTP - Exit function')
+        close_sftp_channel(self.server, self.sftp_session, self.sftp)
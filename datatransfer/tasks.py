@@ -1,125 +1,171 @@
 """Tasks module"""
 
+import concurrent.futures
+import functools
 import logging
 import os
 import json
+import threading
+import time
+from datatransfer import scanner
 from datatransfer import settings
 from datatransfer import storage #This is required - ignore linter
 from datatransfer import utils
+from datatransfer import watcher
 
 
 LOGGER = logging.getLogger(__name__)
 
 
-READSTORAGETYPE = utils.my_import(settings.READ_STORAGE_TYPE)
-WRITESTORAGETYPE = utils.my_import(settings.WRITE_STORAGE_TYPE)
+# The configured storage types, resolved once at start up.
+READ_BACKEND = storage.get_backend(settings.READ_STORAGE_TYPE, 'READ')
+WRITE_BACKEND = storage.get_backend(settings.WRITE_STORAGE_TYPE, 'WRITE')
+
+# Long-lived storages shared by process_files and the MQ consumer. Each thread
+# keeps its own dict, keyed by 'r' / 'w' and holding a (path, storage) tuple,
+# so that transfer workers never share a connection.
+LOCAL = threading.local()
+
+# Worker pool used to transfer a batch of files concurrently.
+EXECUTOR = None
+
+# Snapshot of transferred files used when INCREMENTAL_SCAN is enabled.
+SCANNER = None
 
 
 def storage_type(path, read_write):
-    """Sets up the storage conf values.
+    """Creates a storage of the configured type for the path.
 
-    When setting the storage type the abstract class requires the configuration
-    values for the source and destination.
+    The storage type and its conf values for the source and destination are
+    resolved from the settings once, by `READ_BACKEND` and `WRITE_BACKEND`.
 
     Parameters
     ----------
-    path : dict of `str`: `str`
-        Used to provide the `path` and S3 bucket connection details.
+    path : str
+        The path the storage should use.
 
     read_write: 'str'
-        Used to indicate to the function if the storage
+        'r' for the read storage or 'w' for the write storage.
 
     Returns
     -------
 
     obj:
 
-    Returns the class object for the type of storage that was set in the
-    configuration.
+    Returns an object of the storage type that was set in the configuration.
 
     """
-    LOGGER.debug('Task - Storage type called : ' + path + ' - ' + read_write)
-    LOGGER.debug('Task - ReadStorage : ' + settings.READ_STORAGE_TYPE
-                 + ' - WriteStorage : ' + settings.WRITE_STORAGE_TYPE)
     if read_write == 'r':
-        if (settings.READ_STORAGE_TYPE.endswith('SftpStorage')):
-            conf = {
-                'path': path,
-                'FTP_HOST': settings.READ_FTP_HOST,
-                'FTP_USER': settings.READ_FTP_USER,
-                'FTP_PASSWORD': settings.READ_FTP_PASSWORD,
-                'FTP_PORT': settings.READ_FTP_PORT
-            }
-            LOGGER.info('Task - Setting read storage to SFTP')
-            return READSTORAGETYPE(conf)
-        elif settings.READ_STORAGE_TYPE.endswith('S3Storage'):
-            conf = {
-                'path': path,
-                'AWS_S3_HOST': settings.READ_AWS_S3_HOST,
-                'AWS_S3_BUCKET_NAME': settings.READ_AWS_S3_BUCKET_NAME,
-                'AWS_ACCESS_KEY_ID': settings.READ_AWS_ACCESS_KEY_ID,
-                'AWS_SECRET_ACCESS_KEY': settings.READ_AWS_SECRET_ACCESS_KEY,
-                'AWS_S3_ENCRYPT': settings.READ_AWS_S3_ENCRYPT,
-                'AWS_S3_REGION': settings.READ_AWS_S3_REGION,
-                'USE_IAM_CREDS': settings.USE_IAM_CREDS,
-            }
-            LOGGER.info('Task - Setting read storage to S3')
-            return READSTORAGETYPE(conf)
-        elif settings.READ_STORAGE_TYPE.endswith('FolderStorage'):
-            conf = {
-                'path': path
-            }
-            LOGGER.info('Task - Setting read storage to File server')
-            return READSTORAGETYPE(conf)
-        elif settings.READ_STORAGE_TYPE.endswith('RedisStorage'):
-            conf = {
-                'path': path,
-                'host': settings.READ_REDIS_HOST,
-                'port': settings.READ_REDIS_PORT,
-                'password': settings.READ_REDIS_PASSWORD,
-            }
-            LOGGER.info('Task - Setting read storage to Redis')
-        return READSTORAGETYPE(conf)
-
+        backend = READ_BACKEND
     elif read_write == 'w':
-        if (settings.WRITE_STORAGE_TYPE.endswith('SftpStorage')):
-            conf = {
-                'path': path,
-                'FTP_HOST': settings.WRITE_FTP_HOST,
-                'FTP_USER': settings.WRITE_FTP_USER,
-                'FTP_PASSWORD': settings.WRITE_FTP_PASSWORD,
-                'FTP_PORT': settings.WRITE_FTP_PORT
-            }
-            LOGGER.info('Task - Setting write storage to sFTP')
-            return WRITESTORAGETYPE(conf)
-        elif settings.WRITE_STORAGE_TYPE.endswith('S3Storage'):
-            conf = {
-                'path': path,
-                'AWS_S3_HOST': settings.WRITE_AWS_S3_HOST,
-                'AWS_S3_BUCKET_NAME': settings.WRITE_AWS_S3_BUCKET_NAME,
-                'AWS_ACCESS_KEY_ID': settings.WRITE_AWS_ACCESS_KEY_ID,
-                'AWS_SECRET_ACCESS_KEY': settings.WRITE_AWS_SECRET_ACCESS_KEY,
-                'AWS_S3_ENCRYPT': settings.WRITE_AWS_S3_ENCRYPT,
-                'AWS_S3_REGION': settings.WRITE_AWS_S3_REGION,
-                'USE_IAM_CREDS': settings.USE_IAM_CREDS,
-            }
-            LOGGER.info('Task - Setting write storage to S3')
-            return WRITESTORAGETYPE(conf)
-        elif settings.WRITE_STORAGE_TYPE.endswith('FolderStorage'):
-            conf = {
-                'path': path
-            }
-            LOGGER.info('Task - Setting write storage to File server')
-            return WRITESTORAGETYPE(conf)
-        elif settings.WRITE_STORAGE_TYPE.endswith('RedisStorage'):
-            conf = {
-                'path': path,
-                'host': settings.WRITE_REDIS_HOST,
-                'port': settings.WRITE_REDIS_PORT,
-                'password': settings.WRITE_REDIS_PASSWORD,
-            }
-            LOGGER.info('Task - Settings write storage to Redis')
-        return WRITESTORAGETYPE(conf)
+        backend = WRITE_BACKEND
+    else:
+        raise ValueError('Incorrect value supplied for read_write')
+    LOGGER.info('Task - Setting {0} storage to {1} : {2}'.format(
+        read_write, backend.name, path))
+    return backend.create(path)
+
+def thread_storages():
+    """Gets the storages cached for the current thread.
+
+    Returns
+    -------
+    dict:
+        The cached (path, storage) tuples keyed by 'r' / 'w'.
+    """
+    if not hasattr(LOCAL, 'storages'):
+        LOCAL.storages = {}
+    return LOCAL.storages
+
+
+def get_storage(path, read_write):
+    """Gets a long-lived storage for the path, creating it when required.
+
+    The storage is kept between files so that connections (sFTP transports,
+    S3 resources, redis clients) are reused. A new storage is only created if
+    the path changes or the cached storage reports it is no longer connected.
+
+    Parameters
+    ----------
+    path : str
+        The path the storage should use.
+
+    read_write: 'str'
+        'r' for the read storage or 'w' for the write storage.
+
+    Returns
+    -------
+    obj:
+        The storage object for the path.
+
+    """
+    cached = thread_storages().get(read_write)
+    if cached is not None:
+        cached_path, cached_storage = cached
+        if cached_path == path and cached_storage.is_connected():
+            return cached_storage
+        LOGGER.info('Task - Reconnecting storage : ' + path + ' - ' + read_write)
+        release_storage(read_write)
+
+    new_storage = storage_type(path, read_write)
+    thread_storages()[read_write] = (path, new_storage)
+    return new_storage
+
+
+def release_storage(read_write):
+    """Removes a cached storage and closes its connections.
+
+    Parameters
+    ----------
+    read_write: 'str'
+        'r' for the read storage or 'w' for the write storage.
+    """
+    cached = thread_storages().pop(read_write, None)
+    if cached is not None:
+        try:
+            cached[1].exit()
+        except Exception as err:
+            LOGGER.warning('Task - Error closing storage ' + repr(err))
+
+
+def close_storages():
+    """Closes all of the storages cached for the current thread."""
+    for read_write in list(thread_storages()):
+        release_storage(read_write)
+
+
+def get_executor():
+    """Gets the worker pool used to transfer files, creating it on first use.
+
+    The pool is kept for the life of the process so that each worker thread
+    keeps its storage connections between batches.
+
+    Returns
+    -------
+    obj:
+        A ThreadPoolExecutor with `TRANSFER_WORKERS` threads.
+    """
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=settings.TRANSFER_WORKERS)
+    return EXECUTOR
+
+
+def get_scanner():
+    """Gets the incremental scanner for the read storage, creating it on
+    first use.
+
+    Returns
+    -------
+    obj:
+        An IncrementalScanner using `SCAN_STATE_FILE` for its snapshot.
+    """
+    global SCANNER
+    if SCANNER is None:
+        SCANNER = scanner.IncrementalScanner(settings.SCAN_STATE_FILE)
+    return SCANNER
+
 
 def build_dest_str(dest):
     """Builds destination string with appropriate seperator and
@@ -145,13 +191,36 @@ def build_dest_str(dest):
 
     if dest.endswith(sep):
         dest = dest + settings.TMP_FOLDER_NAME
-    elif not settings.WRITE_STORAGE_TYPE.endswith('RedisStorage'):
+    elif WRITE_BACKEND.uses_temp_folder:
         dest = dest + sep + settings.TMP_FOLDER_NAME
     return dest
 
+def copy_file(file_name, read_storage, write_storage, keep_source=True):
+    """Copies a file from the read storage to the write storage.
+
+    If the write storage can copy directly from the read storage (e.g. an S3
+    server-side copy or a local hard link) that is used, otherwise the file is
+    streamed through this process.
+
+    Parameters
+    ----------
+    file_name: str
+        Name of file to be copied
+
+    keep_source: bool
+        False if the source file is going to be deleted after the copy.
+    """
+    copy_from = getattr(write_storage, 'copy_from', None)
+    if copy_from is not None and copy_from(read_storage, file_name, keep_source):
+        return
+
+    with read_storage.open_read(file_name) as file_obj:
+        write_storage.write_stream(file_name, file_obj)
+
 def move_file(file_name, source=settings.INGEST_SOURCE_PATH,
                          dest=settings.INGEST_DEST_PATH,
-                         copy_files=settings.COPY_FILES):
+                         copy_files=settings.COPY_FILES,
+                         delete_source=True):
     """Moves or copies a specified file from the specified source location
     to the specified destination location
 
@@ -159,11 +228,15 @@ def move_file(file_name, source=settings.INGEST_SOURCE_PATH,
     ----------
     file_name: str
         Name of file to be moved
+
+    delete_source: bool
+        False if the caller removes the source file itself once moved, e.g.
+        with the rest of a batch.
     """
     try:
         dest = build_dest_str(dest)
-        read_storage = storage_type(source, 'r')
-        write_storage = storage_type(dest, 'w')
+        read_storage = get_storage(source, 'r')
+        write_storage = get_storage(dest, 'w')
     except Exception as err:
         LOGGER.exception('Main - Error with storage ' + repr(err))
         raise
@@ -171,35 +244,149 @@ def move_file(file_name, source=settings.INGEST_SOURCE_PATH,
     if file_name == '':
         pass
     try:
-        contents = read_storage.read_file(file_name)
-        write_storage.write_file(file_name, contents)
-        if copy_files.capitalize() == "False":
+        keep_source = copy_files.capitalize() != "False"
+        copy_file(file_name, read_storage, write_storage, keep_source)
+        if not keep_source and delete_source:
             read_storage.delete_file(file_name)
-        if not settings.WRITE_STORAGE_TYPE.endswith(('S3Storage', 'RedisStorage')):
-            write_storage.move_files()
+        if WRITE_BACKEND.uses_temp_folder:
+            write_storage.move_files(file_names=[file_name])
 
     except Exception as err:
         LOGGER.exception('Task - Error with file read/write :' + repr(err))
         raise
 
-def move_file_callback(ch, method, properties, body):
+def try_move_file(args):
+    """Calls move_file, catching any error so that one file cannot stop the
+    rest of a batch.
+
+    Parameters
+    ----------
+    args: tuple
+        The arguments for move_file.
+
+    Returns
+    -------
+    tuple:
+        The file name and the error raised, or None if the file was moved.
+    """
+    try:
+        move_file(*args)
+        return args[0], None
+    except Exception as err:
+        return args[0], err
+
+
+def transfer_files(file_names, source=settings.INGEST_SOURCE_PATH,
+                   dest=settings.INGEST_DEST_PATH,
+                   copy_files=settings.COPY_FILES,
+                   delete_source=True):
+    """Moves or copies a batch of files. When `TRANSFER_WORKERS` is greater
+    than one the files are transferred concurrently by the worker pool.
+
+    Parameters
+    ----------
+    file_names: list of `str`
+        Names of the files to be moved.
+
+    delete_source: bool
+        False to leave moved files at the source, for the caller to remove
+        with `delete_sources`.
+
+    Returns
+    -------
+    dict:
+        `transferred` lists the files that were moved and `failed` maps the
+        files that could not be moved to the error raised.
+    """
+    jobs = [(file_name, source, dest, copy_files, delete_source)
+            for file_name in file_names]
+    if settings.TRANSFER_WORKERS > 1:
+        outcomes = get_executor().map(try_move_file, jobs)
+    else:
+        outcomes = map(try_move_file, jobs)
+
+    results = {'transferred': [], 'failed': {}}
+    for file_name, err in outcomes:
+        if err is None:
+            results['transferred'].append(file_name)
+        else:
+            results['failed'][file_name] = repr(err)
+    LOGGER.info('Task - Transferred {0} files, {1} failed'.format(
+        len(results['transferred']), len(results['failed'])))
+    return results
+
+
+def record_files(file_names, read_storage, dest=settings.INGEST_DEST_PATH,
+                 copy_files=settings.COPY_FILES):
+    """Writes a batch of file names to a redis write storage in a single
+    pipeline. Redis only stores the file names, so the files aren't read.
+
+    Parameters
+    ----------
+    file_names: list of `str`
+        Names of the files to be recorded.
+
+    read_storage: obj
+        The storage the files are removed from unless copying.
+
+    Returns
+    -------
+    dict:
+        `transferred` lists the files that were recorded and `failed` maps the
+        files that could not be removed from the source to the error raised.
+    """
+    write_storage = get_storage(build_dest_str(dest), 'w')
+    write_storage.write_files(file_names)
+    results = {'transferred': list(file_names), 'failed': {}}
+    if copy_files.capitalize() == "False":
+        delete_sources(read_storage, results)
+    return results
+
+
+def delete_sources(read_storage, results):
+    """Deletes the files transferred in a batch from the read storage, using
+    its bulk `delete_files`. Files that can't be deleted are moved from
+    `transferred` to `failed` in the results.
+
+    Parameters
+    ----------
+    read_storage: obj
+        The storage the files were transferred from.
+
+    results: dict
+        The summary of the batch from transfer_files.
+    """
+    for file_name, err in read_storage.delete_files(results['transferred']).items():
+        results['transferred'].remove(file_name)
+        results['failed'][file_name] = err
+
+
+def move_file_callback(ch, method, properties, body, mq=None):
     """Function to be passed as a callback for event consumption.
     Gets filename from mq event, attempts to move file and acks if successful.
+
+    If `READ_MQ_REPUBLISH_QUEUE` is set the event is republished using `mq`,
+    which should be the long-lived MessageQueue being consumed from, so that
+    republishing doesn't open a new connection for every file.
     """
     file_name = json.loads(body.decode('utf-8'))["filename"]
     move_file(file_name)
     re_publish = settings.READ_MQ_REPUBLISH_QUEUE
     if re_publish is not None:
-        mq = storage.create_mq("read")
-        mq.publish_event(file_name, queue_name=re_publish)
-        mq.exit()
+        if mq is None:
+            mq = storage.create_mq("read")
+            mq.publish_event(file_name, queue_name=re_publish)
+            mq.exit()
+        else:
+            mq.publish_event(file_name, queue_name=re_publish)
         LOGGER.debug('MessageQueue - File moved, published to ' + re_publish)
     ch.basic_ack(delivery_tag = method.delivery_tag)
 
 
 def process_files(source=settings.INGEST_SOURCE_PATH,
                   dest=settings.INGEST_DEST_PATH,
-                  copy_files=settings.COPY_FILES):
+                  copy_files=settings.COPY_FILES,
+                  files=None):
     """Processes the files found at the source storage.
 
     This task can be run to move the files from the source path to the new path.
@@ -214,6 +401,16 @@ def process_files(source=settings.INGEST_SOURCE_PATH,
     dest: str
         Provides the destination path to process, defaults to the environment
         setting.
+
+    files: list of str, optional
+        The names of the files to transfer, if already known. Otherwise the
+        source is listed to find them.
+
+    Returns
+    -------
+    dict:
+        The transfer_files summary of the batch, or None when publishing to or
+        consuming from a message queue.
     """
 
     LOGGER.info('Main - Started processing files')
@@ -221,9 +418,7 @@ def process_files(source=settings.INGEST_SOURCE_PATH,
     LOGGER.debug('Main - Read path var : ' + source)
     LOGGER.debug('Main - Write path var : ' + dest)
     try:
-        dest = build_dest_str(dest)
-        read_storage = storage_type(source, 'r')
-        write_storage = storage_type(dest, 'w')
+        read_storage = get_storage(source, 'r')
     except Exception as err:
         LOGGER.exception('Main - Error with storage ' + repr(err))
         raise
@@ -231,18 +426,94 @@ def process_files(source=settings.INGEST_SOURCE_PATH,
     if settings.WRITE_MQ.capitalize() == "True":
         LOGGER.info('Main - Publish to MessageQueue: True')
         mq = storage.create_mq("write")
-        for file_name in read_storage.list_dir():
-            mq.publish_event(file_name)
-            LOGGER.debug('Main - Published {0}'.format(file_name))
+        published = mq.publish_events(read_storage.iter_dir())
+        LOGGER.debug('Main - Published {0} events'.format(published))
         mq.exit()
     else:
         if settings.READ_MQ.capitalize() == "True":
             mq = storage.create_mq("read")
-            mq.consume(callback=move_file_callback)
+            mq.consume(callback=functools.partial(move_file_callback, mq=mq),
+                       prefetch_count=settings.READ_MQ_PREFETCH_COUNT,
+                       workers=settings.READ_MQ_WORKERS)
         else:
-            files = read_storage.list_dir()[:settings.MAX_FILES_BATCH]
-            for file_name in files:
-                move_file(file_name, copy_files=copy_files)
+            scanned = settings.INCREMENTAL_SCAN == 'True'
+            if scanned and not hasattr(read_storage, 'iter_dir_stats'):
+                LOGGER.warning('Main - INCREMENTAL_SCAN is not supported for '
+                               + type(read_storage).__name__ + ', listing the source')
+                scanned = False
+            if scanned and files is None:
+                files = get_scanner().scan(read_storage, limit=settings.MAX_FILES_BATCH)
+            elif scanned:
+                get_scanner().track(read_storage, files)
+            elif files is None:
+                files = list(read_storage.iter_dir(limit=settings.MAX_FILES_BATCH))
+
+            if WRITE_BACKEND.writes_file_names:
+                results = record_files(files, read_storage, dest, copy_files)
+            else:
+                # Keep the sources until the batch is done, then remove them
+                # in bulk.
+                results = transfer_files(files, source, dest, copy_files,
+                                         delete_source=False)
+                if copy_files.capitalize() == "False":
+                    delete_sources(read_storage, results)
+
+            if scanned:
+                get_scanner().commit(results['transferred'])
+            return results
+
+
+def watch_files(source=settings.INGEST_SOURCE_PATH,
+                dest=settings.INGEST_DEST_PATH,
+                copy_files=settings.COPY_FILES,
+                reconcile_interval=settings.WATCH_INTERVAL,
+                iterations=None):
+    """Transfers files from a local folder as soon as they are ready, instead
+    of polling it.
+
+    The source is watched with inotify and each file is transferred once it
+    has been closed after writing or moved into the folder. The folder is
+    still listed with `process_files` on start up, every `reconcile_interval`
+    seconds and whenever the kernel drops events, to pick up anything missed.
+
+    Parameters
+    ----------
+    source: str
+        The local folder to watch, defaults to environment setting.
+
+    dest: str
+        Provides the destination path, defaults to the environment setting.
+
+    reconcile_interval: int
+        Seconds between listings of the folder.
+
+    iterations: int, optional
+        Number of times to wait for events before returning. Runs forever if
+        not supplied.
+    """
+    LOGGER.info('Main - Watching ' + source + ' for files')
+    folder_watcher = watcher.FolderWatcher(source)
+    try:
+        reconcile_at = 0
+        while iterations is None or iterations > 0:
+            if folder_watcher.overflowed or time.monotonic() >= reconcile_at:
+                folder_watcher.overflowed = False
+                results = process_files(source, dest, copy_files)
+                # Files are removed when moved, so keep going while full
+                # batches are found
+                while (copy_files.capitalize() == "False"
+                       and len(results['transferred']) >= settings.MAX_FILES_BATCH):
+                    results = process_files(source, dest, copy_files)
+                reconcile_at = time.monotonic() + reconcile_interval
 
-    read_storage.exit()
-    write_storage.exit()
+            # Skip files already moved by a listing since their event was queued
+            file_names = [file_name for file_name in
+                          folder_watcher.wait(max(reconcile_at - time.monotonic(), 0))
+                          if os.path.isfile(os.path.join(source, file_name))]
+            for i in range(0, len(file_names), settings.MAX_FILES_BATCH):
+                process_files(source, dest, copy_files,
+                              files=file_names[i:i + settings.MAX_FILES_BATCH])
+            if iterations is not None:
+                iterations -= 1
+    finally:
+        folder_watcher.exit()
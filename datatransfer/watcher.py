@@ -0,0 +1,127 @@
+"""Watcher module - used to be notified by the kernel when files are ready in a
+local folder, rather than polling it"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+
+LOGGER = logging.getLogger(__name__)
+
+# Flags from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+EVENT_HEADER = struct.Struct('iIII')
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+def get_libc():
+    """Loads the C library, checking that it provides inotify.
+
+    Returns
+    -------
+    obj:
+        The loaded C library.
+
+    Raises
+    ------
+    OSError
+        If inotify isn't supported on this platform.
+
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, 'inotify is not supported on this platform')
+    return libc
+
+
+class FolderWatcher:
+    """Watches a local directory with inotify for files that are ready to be
+    transferred.
+
+    A file is ready once it has been closed after being written
+    (`IN_CLOSE_WRITE`) or has been moved into the directory (`IN_MOVED_TO`),
+    so files that are still being written aren't picked up. Only Linux is
+    supported.
+
+    Parameters
+    ----------
+    path : str
+        The directory to watch.
+
+    """
+    def __init__(self, path, libc=None):
+        self.path = path
+        self.libc = libc or get_libc()
+        # Set if the kernel dropped events, in which case the directory must
+        # be listed to find the files that were missed.
+        self.overflowed = False
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, 'inotify_init1 - ' + os.strerror(err))
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                         IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch - ' + os.strerror(err), path)
+        LOGGER.debug('Watcher - Watching ' + path)
+
+    def wait(self, timeout=None):
+        """Waits for files to become ready.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum number of seconds to wait. Waits indefinitely if not
+            supplied.
+
+        Returns
+        -------
+        :obj:`list` of `str`
+            The names of the files that are ready, in the order they became
+            ready. Empty if the timeout expired.
+
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        file_names = []
+        while True:
+            try:
+                data = os.read(self.fd, EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            file_names.extend(self._parse_events(data))
+        # A file may be written more than once before it is transferred.
+        return list(dict.fromkeys(file_names))
+
+    def _parse_events(self, data):
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                LOGGER.warning('Watcher - Event queue overflowed for ' + self.path)
+                self.overflowed = True
+            elif mask & IN_IGNORED:
+                LOGGER.warning('Watcher - Watch removed for ' + self.path)
+            elif name and not mask & IN_ISDIR:
+                yield os.fsdecode(name)
+
+    def exit(self):
+        """Stops watching the directory."""
+        os.close(self.fd)
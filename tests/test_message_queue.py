@@ -1,3 +1,4 @@
+import threading
 import unittest
 from datatransfer.storage import MessageQueue, create_mq
 from unittest.mock import MagicMock
@@ -37,6 +38,14 @@ class TestMessageQueue(unittest.TestCase):
         self.assertTrue(mq.publish_event('an_event'))
         self.channel.basic_publish.assert_called()
 
+    def test_event_publish_declares_queue_once(self):
+        self.setup()
+        mq = MessageQueue(self.conf, pika=self.pika)
+        mq.publish_event('an_event', queue_name='another_queue')
+        mq.publish_event('an_event', queue_name='another_queue')
+        mq.publish_event('an_event')
+        self.assertEqual(self.channel.queue_declare.call_count, 2)
+
     def test_event_publish_nack(self):
         self.setup()
         self.channel.basic_publish.return_value = False
@@ -44,6 +53,32 @@ class TestMessageQueue(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             mq.publish_event('an_event')
 
+    def test_events_publish_in_windows(self):
+        self.setup()
+        self.conf['publish_window'] = 2
+        mq = MessageQueue(self.conf, pika=self.pika)
+        self.assertEqual(mq.publish_events(['a', 'b', 'c', 'd', 'e']), 5)
+        self.channel.tx_select.assert_called_once()
+        self.assertEqual(self.channel.basic_publish.call_count, 5)
+        self.assertEqual(self.channel.tx_commit.call_count, 3)
+
+    def test_events_publish_retry(self):
+        self.setup()
+        self.channel.tx_commit.side_effect = [Exception('closed'), None]
+        mq = MessageQueue(self.conf, pika=self.pika)
+        self.assertEqual(mq.publish_events(['a', 'b']), 2)
+        self.assertEqual(self.channel.basic_publish.call_count, 4)
+        self.assertEqual(self.channel.tx_select.call_count, 2)
+
+    def test_events_publish_max_retries(self):
+        self.setup()
+        self.conf['max_retries'] = 2
+        self.channel.tx_commit.side_effect = Exception('closed')
+        mq = MessageQueue(self.conf, pika=self.pika)
+        with self.assertRaises(RuntimeError):
+            mq.publish_events(['a'])
+        self.assertEqual(self.channel.tx_commit.call_count, 3)
+
     def test_create_mq(self):
         mq = create_mq("write")
         self.assertIsNotNone(mq.channel())
@@ -62,6 +97,78 @@ class TestMessageQueue(unittest.TestCase):
         self.channel.basic_consume.assert_called_with(callback, queue=self.conf["queue_name"])
         self.channel.start_consuming.assert_called()
 
+    def test_threaded_consumption(self):
+        self.setup()
+        connection = self.pika.BlockingConnection.return_value
+        connection.add_callback_threadsafe.side_effect = lambda function: function()
+        callback = MagicMock(side_effect=lambda ch, method, properties, body:
+                             ch.basic_ack(delivery_tag=method.delivery_tag))
+
+        def deliver():
+            on_message = self.channel.basic_consume.call_args[0][0]
+            for tag in range(3):
+                method = MagicMock()
+                method.delivery_tag = tag
+                on_message(self.channel, method, None, b'{}')
+        self.channel.start_consuming.side_effect = deliver
+
+        mq = MessageQueue(self.conf, pika=self.pika)
+        mq.consume(callback, workers=2)
+        self.channel.basic_qos.assert_called_with(prefetch_count=2)
+        self.assertEqual(callback.call_count, 3)
+        self.assertEqual(self.channel.basic_ack.call_count, 3)
+
+    def test_threaded_consumption_error_nacks(self):
+        self.setup()
+        connection = self.pika.BlockingConnection.return_value
+        connection.add_callback_threadsafe.side_effect = lambda function: function()
+        method = MagicMock()
+
+        def deliver():
+            on_message = self.channel.basic_consume.call_args[0][0]
+            on_message(self.channel, method, None, b'{}')
+        self.channel.start_consuming.side_effect = deliver
+
+        mq = MessageQueue(self.conf, pika=self.pika)
+        mq.consume(MagicMock(side_effect=IOError('failed')), prefetch_count=5, workers=2)
+        self.channel.basic_qos.assert_called_with(prefetch_count=5)
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=method.delivery_tag,
+                                                        requeue=False)
+        self.channel.basic_ack.assert_not_called()
+
+    def test_workers_finish_after_consumption_stops(self):
+        self.setup()
+        connection = self.pika.BlockingConnection.return_value
+        pending = []
+        release = threading.Event()
+        connection.add_callback_threadsafe.side_effect = pending.append
+
+        def process_data_events(time_limit):
+            release.set()
+            while pending:
+                pending.pop(0)()
+        connection.process_data_events.side_effect = process_data_events
+
+        def callback(ch, method, properties, body):
+            release.wait(5)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        def deliver():
+            on_message = self.channel.basic_consume.call_args[0][0]
+            on_message(self.channel, MagicMock(delivery_tag=1), None, b'{}')
+        self.channel.start_consuming.side_effect = deliver
+
+        mq = MessageQueue(self.conf, pika=self.pika)
+        mq.consume(callback, workers=2)
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+    def test_threadsafe_after_consumption_stops(self):
+        self.setup()
+        mq = MessageQueue(self.conf, pika=self.pika)
+        mq._executor = MagicMock()
+        with self.assertRaises(RuntimeError):
+            mq.threadsafe(MagicMock())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,5 @@
-
 import unittest
-from datatransfer.storage import RedisStorage
+from datatransfer.storage import RedisStorage, REDIS_ADD_FILE_SCRIPT
 from unittest.mock import MagicMock
 
 class TestRedisStorage(unittest.TestCase):
@@ -8,8 +7,11 @@ class TestRedisStorage(unittest.TestCase):
         self.redis = MagicMock()
         self.redis_obj = MagicMock()
         self.redis_obj.lrange.return_value = [b'ke', b'ke']
-        self.redis_obj.rpush.return_value = 1
-        self.redis_obj.lrem.return_value = None
+        self.redis_obj.exists.return_value = True
+        self.add_file = MagicMock(return_value=1)
+        self.redis_obj.register_script.return_value = self.add_file
+        self.pipeline = MagicMock()
+        self.redis_obj.pipeline.return_value = self.pipeline
         self.redis.Redis = MagicMock(return_value = self.redis_obj)
         self.redis_storage = RedisStorage({'path':'foo'}, redis=self.redis)
 
@@ -22,18 +24,68 @@ class TestRedisStorage(unittest.TestCase):
         self.setup()
         self.redis_storage.write_file('aaa', 'aaa')
         self.assertTrue(self.redis_storage.write_file('aaa', 'aaa'))
-        self.redis_obj.rpush.assert_called_with('foo', 'aaa')
+        self.add_file.assert_called_with(keys=['foo', 'foo:members'], args=['aaa'])
+        self.redis_obj.lrange.assert_not_called()
 
     def test_write_file_exists(self):
         self.setup()
+        self.add_file.return_value = 0
         self.assertIsNone(self.redis_storage.write_file('ke', 'ke'))
 
+    def test_add_file_script_trusts_set(self):
+        self.assertIn("'SADD', KEYS[2]", REDIS_ADD_FILE_SCRIPT)
+        self.assertNotIn('LRANGE', REDIS_ADD_FILE_SCRIPT)
 
     def test_delete_file(self):
         self.setup()
         self.redis_storage.delete_file('aaa')
         self.assertTrue(self.redis_storage.delete_file('aaa'))
-        self.redis_obj.lrem.assert_called_with('foo', 'aaa')
+        self.pipeline.lrem.assert_called_with('foo', 'aaa')
+        self.pipeline.srem.assert_called_with('foo:members', 'aaa')
+        self.pipeline.execute.assert_called()
+
+    def test_migrate_existing_list(self):
+        self.setup()
+        self.redis_obj.exists.side_effect = lambda key: key == 'foo'
+        RedisStorage({'path': 'foo'}, redis=self.redis)
+        self.redis_obj.sadd.assert_called_once_with('foo:members', b'ke', b'ke')
+
+    def test_no_migration_with_set(self):
+        self.setup()
+        self.redis_obj.sadd.assert_not_called()
+        self.redis_obj.lrange.assert_not_called()
+
+    def test_write_files(self):
+        self.setup()
+        self.pipeline.execute.return_value = [3, 0, 4]
+        self.assertEqual(self.redis_storage.write_files(['a', 'b', 'c']), ['a', 'c'])
+        self.add_file.assert_called_with(keys=['foo', 'foo:members'], args=['c'],
+                                         client=self.pipeline)
+        self.assertEqual(self.add_file.call_count, 3)
+        self.pipeline.execute.assert_called_once()
+
+    def test_delete_files(self):
+        self.setup()
+        error = Exception('failed')
+        self.pipeline.execute.return_value = [1, 1, error, 0]
+        self.assertEqual(self.redis_storage.delete_files(['a', 'b']), {'b': repr(error)})
+        self.redis_obj.pipeline.assert_called_with(transaction=True)
+        self.assertEqual(self.pipeline.lrem.call_count, 2)
+        self.pipeline.execute.assert_called_once_with(raise_on_error=False)
+
+    def test_iter_dir_pages(self):
+        self.setup()
+        self.redis_obj.lrange.side_effect = [[b'a', b'b'], [b'c', b'd'], [b'e']]
+        self.assertEqual(list(self.redis_storage.iter_dir(page_size=2)),
+                         [b'a', b'b', b'c', b'd', b'e'])
+        self.redis_obj.lrange.assert_called_with('foo', 4, 5)
+
+    def test_iter_dir_limit(self):
+        self.setup()
+        self.redis_obj.lrange.side_effect = [[b'a', b'b'], [b'c', b'd']]
+        self.assertEqual(list(self.redis_storage.iter_dir(limit=3, page_size=2)),
+                         [b'a', b'b', b'c'])
+        self.assertEqual(self.redis_obj.lrange.call_count, 2)
 
 if __name__ == "__main__":
     unittest.main()
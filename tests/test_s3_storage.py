@@ -0,0 +1,172 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import botocore
+from datatransfer import settings
+from datatransfer import storage
+from datatransfer.storage import S3RangedReader, S3Storage
+
+CONTENT = b'0123456789abcdefghij'
+
+
+def ranged_get(Range, IfMatch=None):
+    if IfMatch not in (None, '"etag"'):
+        raise botocore.exceptions.ClientError(
+            {'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+    start, end = (int(i) for i in Range[len('bytes='):].split('-'))
+    body = MagicMock()
+    body.read.return_value = CONTENT[start:end + 1]
+    return {'Body': body, 'ETag': '"etag"',
+            'ContentRange': 'bytes {0}-{1}/{2}'.format(start, end, len(CONTENT))}
+
+
+class TestS3Storage(unittest.TestCase):
+    def setup(self):
+        self.bucket = MagicMock()
+        self.storage = self.create_storage(self.bucket, 'foo/tmp')
+
+    def create_storage(self, bucket, path, access_key='accessKey1'):
+        with patch('datatransfer.storage.s3_storage.get_bucket', return_value=bucket):
+            return S3Storage({'path': path,
+                              'AWS_S3_BUCKET_NAME': 'bucket',
+                              'AWS_ACCESS_KEY_ID': access_key,
+                              'AWS_S3_ENCRYPT': 'aws:kms'})
+
+    def test_ranged_reader(self):
+        s3_object = MagicMock()
+        s3_object.get.side_effect = ranged_get
+        with S3RangedReader(s3_object, 3, 2) as reader:
+            self.assertEqual(reader.read(), CONTENT)
+        self.assertEqual(s3_object.get.call_count, 7)
+
+    def test_ranged_reader_pinned_to_etag(self):
+        s3_object = MagicMock()
+        s3_object.get.side_effect = ranged_get
+        with S3RangedReader(s3_object, 3, 2) as reader:
+            reader.read()
+        for call in s3_object.get.call_args_list[1:]:
+            self.assertEqual(call[1]['IfMatch'], '"etag"')
+
+    def test_ranged_reader_object_replaced(self):
+        s3_object = MagicMock()
+        s3_object.get.side_effect = ranged_get
+        reader = S3RangedReader(s3_object, 3, 1)
+        reader.etag = '"replaced"'
+        with self.assertRaises(botocore.exceptions.ClientError):
+            reader.read()
+        reader.close()
+
+    def test_ranged_reader_small_object(self):
+        s3_object = MagicMock()
+        s3_object.get.side_effect = ranged_get
+        with S3RangedReader(s3_object, 100, 2) as reader:
+            self.assertIsNone(reader.executor)
+            self.assertEqual(reader.read(), CONTENT)
+        s3_object.get.assert_called_once_with(Range='bytes=0-99')
+
+    def test_write_file_from_memory(self):
+        self.setup()
+        self.assertTrue(self.storage.write_file('aaa', b'aaa'))
+        args, kwargs = self.bucket.upload_fileobj.call_args
+        self.assertEqual(args[0].read(), b'aaa')
+        self.assertEqual(args[1], 'foo/aaa')
+        self.assertEqual(kwargs['ExtraArgs'], {'ServerSideEncryption': 'aws:kms'})
+        self.assertIs(kwargs['Config'], self.storage.transfer_config)
+
+    def test_read_file(self):
+        self.setup()
+        self.bucket.download_fileobj.side_effect = \
+            lambda key, file_obj, Config: file_obj.write(CONTENT)
+        self.assertEqual(self.storage.read_file('aaa'), CONTENT)
+
+    def test_copy_from_same_credentials(self):
+        self.setup()
+        source_bucket = MagicMock()
+        source_bucket.name = 'source'
+        source = self.create_storage(source_bucket, 'bar')
+        self.assertTrue(self.storage.copy_from(source, 'aaa'))
+        self.bucket.copy.assert_called_once_with(
+            {'Bucket': 'source', 'Key': 'bar/aaa'}, 'foo/aaa',
+            ExtraArgs={'ServerSideEncryption': 'aws:kms'},
+            Config=self.storage.transfer_config)
+        source_bucket.download_fileobj.assert_not_called()
+
+    def test_copy_from_other_credentials(self):
+        self.setup()
+        source = self.create_storage(MagicMock(), 'bar', 'anotherKey')
+        self.assertFalse(self.storage.copy_from(source, 'aaa'))
+        self.assertFalse(self.storage.copy_from(MagicMock(spec=[]), 'aaa'))
+        self.bucket.copy.assert_not_called()
+
+    def test_iter_dir_limit(self):
+        self.setup()
+        self.bucket.name = 'bucket'
+        paginator = self.bucket.meta.client.get_paginator.return_value
+        paginator.paginate.return_value = iter([
+            {'Contents': [{'Key': 'foo/a'}, {'Key': 'foo/sub/b'}, {'Key': 'foo/c'}]},
+            {'Contents': [{'Key': 'foo/d'}]},
+        ])
+        self.assertEqual(list(self.storage.iter_dir(limit=2)), ['a', 'c'])
+        paginator.paginate.assert_called_once_with(
+            Bucket='bucket', Prefix='foo/', Delimiter='/',
+            PaginationConfig={'PageSize': 2})
+
+    def test_iter_dir_resume(self):
+        self.setup()
+        self.bucket.name = 'bucket'
+        self.storage.resume_listing = True
+        paginator = self.bucket.meta.client.get_paginator.return_value
+        paginator.paginate.side_effect = [
+            iter([{'Contents': [{'Key': 'foo/a'}, {'Key': 'foo/b'}, {'Key': 'foo/c'}]}]),
+            iter([{'Contents': [{'Key': 'foo/c'}]}]),
+            iter([{'Contents': [{'Key': 'foo/a'}]}]),
+        ]
+        self.assertEqual(list(self.storage.iter_dir(limit=2)), ['a', 'b'])
+        self.assertEqual(list(self.storage.iter_dir(limit=2)), ['c'])
+        self.assertEqual(paginator.paginate.call_args[1]['StartAfter'], 'foo/b')
+        self.assertEqual(list(self.storage.iter_dir(limit=2)), ['a'])
+        self.assertNotIn('StartAfter', paginator.paginate.call_args[1])
+
+    def test_delete_files(self):
+        self.setup()
+        file_names = ['file{0}'.format(i) for i in range(2500)]
+        self.bucket.delete_objects.side_effect = [
+            {'Errors': [{'Key': 'foo/file3', 'Code': 'AccessDenied', 'Message': 'Denied'}]},
+            {},
+            botocore.exceptions.ClientError({'Error': {'Code': 'SlowDown'}}, 'DeleteObjects'),
+        ]
+        errors = self.storage.delete_files(file_names)
+        self.assertEqual(self.bucket.delete_objects.call_count, 3)
+        batches = [call[1]['Delete']['Objects']
+                   for call in self.bucket.delete_objects.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [1000, 1000, 500])
+        self.assertEqual(batches[0][0], {'Key': 'foo/file0'})
+        self.assertEqual(errors['file3'], 'AccessDenied: Denied')
+        self.assertEqual(len(errors), 501)
+        self.assertIn('file2499', errors)
+
+
+class TestS3Resource(unittest.TestCase):
+    conf = {'AWS_S3_HOST': 'http://s3server:8000',
+            'AWS_S3_REGION': 'eu-west-2',
+            'AWS_ACCESS_KEY_ID': 'accessKey1',
+            'AWS_SECRET_ACCESS_KEY': 'verySecretKey1'}
+
+    def setUp(self):
+        storage.S3_RESOURCES.clear()
+
+    def test_client_shared(self):
+        first = storage.get_bucket('bucket', self.conf)
+        second = storage.get_bucket('bucket', dict(self.conf))
+        self.assertIsNot(first, second)
+        self.assertIs(first.meta.client, second.meta.client)
+        self.assertEqual(first.meta.client.meta.config.max_pool_connections,
+                         settings.AWS_S3_MAX_POOL_CONNECTIONS)
+
+    def test_client_per_credentials(self):
+        first = storage.get_bucket('bucket', self.conf)
+        second = storage.get_bucket('bucket', dict(self.conf, AWS_ACCESS_KEY_ID='accessKey2'))
+        self.assertIsNot(first.meta.client, second.meta.client)
+
+
+if __name__ == "__main__":
+    unittest.main()
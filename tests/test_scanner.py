@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from datatransfer.scanner import IncrementalScanner
+from datatransfer.storage import FolderStorage
+
+
+class TestIncrementalScanner(unittest.TestCase):
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.storage = FolderStorage({'path': self.path})
+        for file_name in ['a', 'b', 'c']:
+            self.write(file_name, b'aaa')
+
+    def write(self, file_name, content):
+        with open(os.path.join(self.path, file_name), 'wb') as file:
+            file.write(content)
+
+    def teardown(self):
+        shutil.rmtree(self.path)
+
+    def test_only_new_or_changed(self):
+        self.setup()
+        scanner = IncrementalScanner()
+        self.assertEqual(sorted(scanner.scan(self.storage)), ['a', 'b', 'c'])
+        scanner.commit(['a', 'b', 'c'])
+        self.assertEqual(scanner.scan(self.storage), [])
+        self.write('b', b'bbbb')
+        self.write('d', b'ddd')
+        self.assertEqual(sorted(scanner.scan(self.storage)), ['b', 'd'])
+        self.teardown()
+
+    def test_uncommitted_files_rescanned(self):
+        self.setup()
+        scanner = IncrementalScanner()
+        batch = scanner.scan(self.storage, limit=2)
+        self.assertEqual(len(batch), 2)
+        scanner.commit(batch[:1])
+        self.assertEqual(len(scanner.scan(self.storage)), 2)
+        self.teardown()
+
+    def test_unchanged_directory_not_listed(self):
+        storage = MagicMock()
+        storage.dir_signature.return_value = 1.0
+        storage.iter_dir_stats.return_value = iter([('a', (1, 3))])
+        scanner = IncrementalScanner()
+        self.assertEqual(scanner.scan(storage), ['a'])
+        scanner.commit(['a'])
+        self.assertEqual(scanner.scan(storage), [])
+        storage.iter_dir_stats.assert_called_once()
+        storage.dir_signature.return_value = 2.0
+        storage.iter_dir_stats.return_value = iter([('a', (1, 3)), ('b', (1, 3))])
+        self.assertEqual(scanner.scan(storage), ['b'])
+
+    def test_state_file(self):
+        self.setup()
+        state_file = os.path.join(tempfile.mkdtemp(), 'scan.json')
+        scanner = IncrementalScanner(state_file)
+        scanner.commit(scanner.scan(self.storage))
+        self.assertEqual(IncrementalScanner(state_file).scan(self.storage), [])
+        shutil.rmtree(os.path.dirname(state_file))
+        self.teardown()
+
+    def test_tracked_files_committed(self):
+        self.setup()
+        scanner = IncrementalScanner()
+        scanner.track(self.storage, ['a', 'b', 'missing'])
+        self.assertEqual(sorted(scanner.batch), ['a', 'b'])
+        scanner.commit(['a', 'b'])
+        self.assertEqual(scanner.scan(self.storage), ['c'])
+        self.teardown()
+
+    def test_saved_only_when_changed(self):
+        self.setup()
+        scanner = IncrementalScanner('scan.json')
+        scanner.save = MagicMock()
+        scanner.commit(scanner.scan(self.storage))
+        scanner.save.assert_called_once_with()
+        scanner.commit(scanner.scan(self.storage))
+        scanner.save.assert_called_once_with()
+        os.remove(os.path.join(self.path, 'a'))
+        scanner.commit(scanner.scan(self.storage))
+        self.assertEqual(scanner.save.call_count, 2)
+        self.teardown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,395 @@
+import concurrent.futures
+import errno
+import io
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest.mock import MagicMock
+
+import paramiko
+
+from datatransfer import settings
+from datatransfer import storage
+from datatransfer.storage import SftpStorage
+
+
+CONF = {
+    'FTP_HOST': 'sftp_server',
+    'FTP_USER': 'foo',
+    'FTP_PASSWORD': 'pass',
+    'FTP_PORT': '22'
+}
+
+
+class FakeSftp:
+    """In memory sFTP client that counts the requests made to the server."""
+    def __init__(self, dirs=()):
+        self.dirs = set(dirs) | {'/'}
+        self.requests = []
+        self.file = MagicMock()
+
+    def normalize(self, path):
+        self.requests.append(('normalize', path))
+        return '/'
+
+    def stat(self, path):
+        self.requests.append(('stat', path))
+        if path not in self.dirs:
+            raise IOError(errno.ENOENT, 'No such file')
+        return MagicMock(st_mode=stat.S_IFDIR)
+
+    def mkdir(self, path):
+        self.requests.append(('mkdir', path))
+        if path in self.dirs:
+            raise IOError('Failure')
+        self.dirs.add(path)
+
+    def open(self, path, mode, bufsize=-1):
+        self.requests.append(('open', path))
+        if os.path.dirname(path) not in self.dirs:
+            raise IOError(errno.ENOENT, 'No such file')
+        return self.file
+
+
+def get_storage(sftp, path):
+    paramiko = MagicMock()
+    paramiko.SFTPClient.from_transport.return_value = sftp
+    return SftpStorage(dict(CONF, path=path), paramiko=paramiko)
+
+
+class TestSftpStorage(unittest.TestCase):
+    def setUp(self):
+        storage.SFTP_KNOWN_DIRS.clear()
+        storage.SFTP_HOME_DIRS.clear()
+        storage.SFTP_TRANSPORTS.clear()
+
+    def test_creates_missing_dirs(self):
+        sftp = FakeSftp({'/upload'})
+        result = get_storage(sftp, '/upload/2018/01/02/tmp')
+        self.assertEqual(result.remote_path, '/upload/2018/01/02/tmp')
+        self.assertEqual(sftp.dirs, {'/', '/upload', '/upload/2018', '/upload/2018/01',
+                                     '/upload/2018/01/02', '/upload/2018/01/02/tmp'})
+
+    def test_known_dirs_not_checked(self):
+        sftp = FakeSftp({'/upload', '/upload/2018', '/upload/2018/01'})
+        get_storage(sftp, '/upload/2018/01/01')
+        sftp.requests = []
+        get_storage(sftp, '/upload/2018/01/01')
+        self.assertEqual(sftp.requests, [])
+        get_storage(sftp, '/upload/2018/01/02')
+        self.assertEqual(sftp.requests, [('stat', '/upload/2018/01/02'),
+                                         ('mkdir', '/upload/2018/01/02')])
+
+    def test_created_by_another_worker(self):
+        sftp = FakeSftp({'/upload'})
+        mkdir = sftp.mkdir
+
+        def racing_mkdir(path):
+            sftp.dirs.add(path)
+            mkdir(path)
+        sftp.mkdir = racing_mkdir
+        get_storage(sftp, '/upload/new')
+        self.assertIn('/upload/new', sftp.dirs)
+
+    def test_removed_dir_recreated(self):
+        sftp = FakeSftp({'/upload'})
+        result = get_storage(sftp, '/upload/new/tmp')
+        sftp.dirs = {'/', '/upload'}
+        result.write_file('a.csv', b'aaa')
+        self.assertIn('/upload/new/tmp', sftp.dirs)
+
+    def test_pipelined_and_prefetched(self):
+        sftp = FakeSftp({'/upload'})
+        sftp.file.__enter__.return_value = sftp.file
+        sftp.file.read.return_value = b'aaa'
+        result = get_storage(sftp, '/upload')
+        result.write_file('a.csv', b'aaa')
+        sftp.file.set_pipelined.assert_called_with(True)
+        self.assertEqual(result.read_file('a.csv'), b'aaa')
+        sftp.file.prefetch.assert_called_once_with()
+
+    def test_stream_read_ahead_bounded(self):
+        sftp = FakeSftp({'/upload'})
+        sftp.file.stat.return_value.st_size = 5
+        sftp.file.readv.side_effect = lambda chunks: (b'x' * size for _, size in chunks)
+        result = get_storage(sftp, '/upload')
+        buffer_size, readahead = settings.SFTP_BUFFER_SIZE, settings.SFTP_READAHEAD_SIZE
+        settings.SFTP_BUFFER_SIZE, settings.SFTP_READAHEAD_SIZE = 1, 2
+        try:
+            with result.open_read('a.csv') as reader:
+                self.assertEqual(reader.read(), b'xxxxx')
+        finally:
+            settings.SFTP_BUFFER_SIZE, settings.SFTP_READAHEAD_SIZE = buffer_size, readahead
+        self.assertEqual([call[0][0] for call in sftp.file.readv.call_args_list],
+                         [[(0, 1), (1, 1)], [(2, 1), (3, 1)], [(4, 1)]])
+        sftp.file.prefetch.assert_not_called()
+        sftp.file.close.assert_called_once_with()
+
+    def test_relative_to_home(self):
+        sftp = FakeSftp({'/home/foo'})
+        sftp.normalize = lambda path: '/home/foo'
+        result = get_storage(sftp, 'upload')
+        self.assertEqual(result.remote_path, '/home/foo/upload')
+        self.assertIn('/home/foo/upload', sftp.dirs)
+
+    def test_absolute_path_not_under_home(self):
+        sftp = FakeSftp({'/home/foo', '/data'})
+        sftp.normalize = MagicMock(return_value='/home/foo')
+        result = get_storage(sftp, '/data/in')
+        self.assertEqual(result.remote_path, '/data/in')
+        self.assertIn('/data/in', sftp.dirs)
+        sftp.normalize.assert_not_called()
+
+    def test_lock_not_held_while_connecting(self):
+        locked = []
+
+        def connect(*args, **kwargs):
+            locked.append(storage.SFTP_TRANSPORTS_LOCK.locked())
+            time.sleep(0.05)
+            return MagicMock()
+        paramiko = MagicMock()
+        paramiko.Transport.side_effect = connect
+        paramiko.SFTPClient.from_transport.return_value = FakeSftp({'/upload'})
+        conf = dict(CONF, path='/upload')
+        with concurrent.futures.ThreadPoolExecutor(3) as executor:
+            list(executor.map(lambda _: SftpStorage(conf, paramiko=paramiko), range(3)))
+        # The storages waited for the first connection rather than each
+        # connecting
+        self.assertEqual(locked, [False])
+        entry, = storage.SFTP_TRANSPORTS[('sftp_server', '22', 'foo')]
+        self.assertEqual(entry[1], 3)
+
+    def test_failed_connection_released(self):
+        paramiko = MagicMock()
+        paramiko.Transport.return_value.connect.side_effect = socket.timeout()
+        with self.assertRaises(socket.timeout):
+            SftpStorage(dict(CONF, path='/upload'), paramiko=paramiko)
+        self.assertEqual(storage.SFTP_TRANSPORTS[('sftp_server', '22', 'foo')], [])
+
+
+class LocalSftpServer(paramiko.SFTPServerInterface):
+    """sFTP server backed by a local directory, which delays every request by
+    `latency` seconds and records its name in `requests`."""
+    def __init__(self, server, root, latency, requests):
+        super().__init__(server)
+        self.root = root
+        self.latency = latency
+        self.requests = requests
+
+    def request(self, name):
+        self.requests.append(name)
+        time.sleep(self.latency)
+
+    def local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def canonicalize(self, path):
+        if path in ('.', ''):
+            self.request('canonicalize')
+        return super().canonicalize(path)
+
+    def open(self, path, flags, attr):
+        self.request('open')
+        try:
+            fd = os.open(self.local(path), flags, 0o644)
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        mode = 'r+b' if flags & (os.O_WRONLY | os.O_RDWR) else 'rb'
+        handle = LocalSftpHandle(flags)
+        handle.server = self
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def list_folder(self, path):
+        self.request('list_folder')
+        try:
+            folder = self.local(path)
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(folder, name)),
+                                                      name)
+                    for name in os.listdir(folder)]
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+    def stat(self, path):
+        self.request('stat')
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+
+    lstat = stat
+
+    def remove(self, path):
+        self.request('remove')
+        try:
+            os.remove(self.local(path))
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        self.request('posix_rename')
+        try:
+            os.replace(self.local(oldpath), self.local(newpath))
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        self.request('mkdir')
+        try:
+            os.mkdir(self.local(path))
+        except OSError as err:
+            return paramiko.SFTPServer.convert_errno(err.errno)
+        return paramiko.SFTP_OK
+
+
+class LocalSftpHandle(paramiko.SFTPHandle):
+    def stat(self):
+        self.server.request('fstat')
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def read(self, offset, length):
+        self.server.request('read')
+        return super().read(offset, length)
+
+    def write(self, offset, data):
+        self.server.request('write')
+        return super().write(offset, data)
+
+    def close(self):
+        self.server.request('close')
+        super().close()
+
+
+class AllowAll(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+class TestSftpStorageRoundTrips(unittest.TestCase):
+    """Runs SftpStorage against a local sFTP server with latency on every
+    request, to check how many round trips each operation takes."""
+    latency = 0.005
+
+    @classmethod
+    def setUpClass(cls):
+        cls.host_key = paramiko.RSAKey.generate(2048)
+
+    def setUp(self):
+        storage.SFTP_KNOWN_DIRS.clear()
+        storage.SFTP_HOME_DIRS.clear()
+        storage.SFTP_TRANSPORTS.clear()
+        self.root = tempfile.mkdtemp()
+        self.requests = []
+        self.transports = []
+        self.paramiko = types.SimpleNamespace(Transport=self.transport,
+                                              SFTPClient=paramiko.SFTPClient,
+                                              SSHException=paramiko.SSHException)
+
+    def tearDown(self):
+        for transport in self.transports:
+            transport.close()
+        shutil.rmtree(self.root)
+
+    def transport(self, address, **kwargs):
+        """Starts a local server and returns a client transport for it."""
+        server_sock, client_sock = socket.socketpair()
+        server = paramiko.Transport(server_sock)
+        server.add_server_key(self.host_key)
+        server.set_subsystem_handler('sftp', paramiko.SFTPServer, LocalSftpServer,
+                                     self.root, self.latency, self.requests)
+        threading.Thread(target=server.start_server, kwargs={'server': AllowAll()},
+                         daemon=True).start()
+        client = paramiko.Transport(client_sock, **kwargs)
+        self.transports += [server, client]
+        return client
+
+    def connect(self, path):
+        return SftpStorage(dict(CONF, path=path), paramiko=self.paramiko)
+
+    def test_round_trips(self):
+        self.connect('/upload/tmp')
+        self.assertTrue(os.path.isdir(os.path.join(self.root, 'upload', 'tmp')))
+        self.requests.clear()
+        sftp = self.connect('/upload/tmp')
+        self.assertEqual(self.requests, [])
+
+        sftp.write_file('a.csv', b'aaa')
+        self.assertEqual(self.requests, ['open', 'write', 'close'])
+        self.requests.clear()
+
+        self.assertEqual(sftp.read_file('a.csv'), b'aaa')
+        self.assertEqual(self.requests[:2], ['open', 'fstat'])
+        self.assertEqual(self.requests[2:], ['read'] * (len(self.requests) - 3) + ['close'])
+        self.requests.clear()
+
+        self.assertEqual(sftp.list_dir(), ['a.csv'])
+        self.assertEqual(self.requests, ['list_folder'])
+        self.requests.clear()
+
+        tmp = self.connect('/upload/tmp/tmp')
+        tmp.write_file('b.csv', b'bbb')
+        self.requests.clear()
+        tmp.move_files(file_names=['b.csv'])
+        self.assertEqual(self.requests, ['posix_rename'])
+        self.assertEqual(sftp.list_dir(), ['a.csv', 'b.csv'])
+        self.requests.clear()
+
+        start = time.monotonic()
+        sftp.delete_file('a.csv')
+        self.assertEqual(self.requests, ['remove'])
+        self.assertLess(time.monotonic() - start, 10 * self.latency)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'upload', 'tmp', 'a.csv')))
+
+
+    def test_large_transfer(self):
+        sftp = self.connect('/upload')
+        content = os.urandom(1024 * 1024 + 1)
+        sftp.write_stream('large.bin', io.BytesIO(content))
+        with open(os.path.join(self.root, 'upload', 'large.bin'), 'rb') as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(sftp.read_file('large.bin'), content)
+        with sftp.open_read('large.bin') as reader:
+            self.assertEqual(reader.read(), content)
+        self.assertIsNone(sftp.read_file('missing.bin'))
+
+
+    def test_channels_share_transport(self):
+        channels = settings.SFTP_CHANNELS
+        settings.SFTP_CHANNELS = 2
+        try:
+            storages = [self.connect('/upload') for _ in range(3)]
+            clients = {id(result.sftp_session) for result in storages}
+            self.assertEqual(len(clients), 2)
+            self.assertEqual(len({id(result.sftp) for result in storages}), 3)
+            with concurrent.futures.ThreadPoolExecutor(3) as executor:
+                list(executor.map(lambda args: args[0].write_file(args[1], b'aaa'),
+                                  zip(storages, ['a', 'b', 'c'])))
+            self.assertEqual(sorted(storages[0].list_dir()), ['a', 'b', 'c'])
+
+            storages[0].exit()
+            self.assertTrue(storages[1].is_connected())
+            storages[1].exit()
+            self.assertFalse(storages[1].is_connected())
+            # The freed channel is reused rather than connecting again
+            self.connect('/upload')
+            self.assertEqual(len(storage.SFTP_TRANSPORTS[storages[2].server]), 1)
+        finally:
+            settings.SFTP_CHANNELS = channels
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,16 +3,19 @@ import os
 import json
 from pathlib import Path
 import shutil
+import time
 import unittest
 from datetime import datetime, timedelta
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from datatransfer import settings
 from datatransfer.storage import FolderStorage
 from datatransfer.storage import S3Storage
 from datatransfer.storage import SftpStorage
 from datatransfer.storage import RedisStorage
+from datatransfer.storage import StorageBackend, get_backend
 from datatransfer.tasks import process_files
+from datatransfer import tasks
 from datatransfer import utils
 
 
@@ -47,6 +50,15 @@ class TestStorage(unittest.TestCase):
             storage.read_file(file_name)
         self.teardown()
 
+    def test_file_path_iter_limit(self):
+        """Check file iteration stops at the limit"""
+        self.setup()
+        storage = FolderStorage({'path': './tests/files'})
+        result = list(storage.iter_dir(limit=2))
+        self.assertEqual(len(result), 2)
+        self.assertTrue(set(result) <= set(TEST_FILE_LIST))
+        self.teardown()
+
     def test_read_delete_from_s3_bucket(self):
         """Tests the read and delete from the S3 bucket"""
         conf = {
@@ -166,6 +178,63 @@ class TestStorage(unittest.TestCase):
         self.assertListEqual(sorted(result), sorted(TEST_FILE_LIST))
 
 
+    def test_process_files_deletes_in_bulk(self):
+        """Tests sources are removed with one delete_files call per batch"""
+        self.setup()
+        with patch.object(FolderStorage, 'delete_file', side_effect=AssertionError), \
+                patch.object(FolderStorage, 'delete_files',
+                             wraps=FolderStorage({'path': 'tests/files'}).delete_files) as delete:
+            results = process_files('tests/files', 'tests/files/done')
+        delete.assert_called_once()
+        self.assertEqual(sorted(results['transferred']), sorted(TEST_FILE_LIST))
+        self.assertEqual(sorted(FolderStorage({'path': 'tests/files'}).list_dir()), [])
+        for file_name in TEST_FILE_LIST:
+            Path(os.path.join('tests/files', file_name)).touch()
+        self.teardown()
+
+    def test_incremental_scan_unsupported_source(self):
+        """Tests a source without file stats is listed instead of scanned"""
+        read_storage = MagicMock(spec=RedisStorage)
+        read_storage.iter_dir.return_value = iter(['a'])
+        results = {'transferred': ['a'], 'failed': {}}
+        with patch.object(settings, 'INCREMENTAL_SCAN', 'True'), \
+                patch.object(tasks, 'get_storage', return_value=read_storage), \
+                patch.object(tasks, 'get_scanner', side_effect=AssertionError), \
+                patch.object(tasks, 'transfer_files', return_value=results) as transfer:
+            self.assertEqual(process_files('redis', 'tests/files/done', 'True'), results)
+        transfer.assert_called_once_with(['a'], 'redis', 'tests/files/done', 'True',
+                                         delete_source=False)
+
+    def test_storage_backend_conf(self):
+        """Tests storage types are resolved with the conf from their schema"""
+        backend = get_backend('datatransfer.storage.SftpStorage', 'WRITE')
+        self.assertIs(backend, get_backend('datatransfer.storage.SftpStorage', 'WRITE'))
+        self.assertIs(backend.storage_class, SftpStorage)
+        self.assertEqual(backend.conf, {'FTP_HOST': settings.WRITE_FTP_HOST,
+                                        'FTP_USER': settings.WRITE_FTP_USER,
+                                        'FTP_PASSWORD': settings.WRITE_FTP_PASSWORD,
+                                        'FTP_PORT': settings.WRITE_FTP_PORT})
+        self.assertTrue(backend.uses_temp_folder)
+        s3_backend = StorageBackend('datatransfer.storage.S3Storage', 'WRITE')
+        self.assertIsNone(s3_backend.conf['AWS_S3_RESUME_LISTING'])
+        self.assertFalse(s3_backend.uses_temp_folder)
+        self.assertTrue(StorageBackend('datatransfer.storage.RedisStorage',
+                                       'READ').writes_file_names)
+
+    def test_new_storage_type(self):
+        """Tests a new storage type only needs a class with a settings schema"""
+        class MemoryStorage:
+            SETTINGS = {'host': '{0}_REDIS_HOST'}
+
+            def __init__(self, conf):
+                self.conf = conf
+        with patch.object(utils, 'my_import', return_value=MemoryStorage):
+            backend = StorageBackend('memory.MemoryStorage', 'READ')
+        with patch.object(tasks, 'READ_BACKEND', backend):
+            result = tasks.storage_type('files', 'r')
+        self.assertIsInstance(result, MemoryStorage)
+        self.assertEqual(result.conf, {'host': settings.READ_REDIS_HOST, 'path': 'files'})
+
     def test_folder_storage_delete(self):
         """" Tests the folder storage delete function last as files are Used
             in other tests """
@@ -248,6 +317,124 @@ class TestStorage(unittest.TestCase):
         mock.test_func.assert_called()
         self.teardown()
 
+    def test_folder_stream(self):
+        """Tests files are streamed between folder storages in chunks"""
+        self.setup()
+        source = FolderStorage({'path': 'tests/files'})
+        dest = FolderStorage({'path': 'tests/files/done'})
+        chunk_size = settings.TRANSFER_CHUNK_SIZE
+        settings.TRANSFER_CHUNK_SIZE = 4
+        try:
+            with source.open_read(TEST_FILE_LIST[0]) as file_obj:
+                self.assertTrue(dest.write_stream(TEST_FILE_LIST[0], file_obj))
+        finally:
+            settings.TRANSFER_CHUNK_SIZE = chunk_size
+        self.assertEqual(dest.read_file(TEST_FILE_LIST[0]), TEST_CONTENT)
+        self.teardown()
+
+    def test_folder_move_links_file(self):
+        """Tests moves between folders on one device keep the same file"""
+        self.setup()
+        inode = os.stat(os.path.join('tests/files', TEST_FILE_LIST[0])).st_ino
+        results = tasks.transfer_files(TEST_FILE_LIST[:1], 'tests/files',
+                                       'tests/files/done', 'False')
+        self.assertListEqual(results['transferred'], TEST_FILE_LIST[:1])
+        self.assertFalse(os.path.exists(os.path.join('tests/files', TEST_FILE_LIST[0])))
+        moved = os.path.join('tests/files/done', TEST_FILE_LIST[0])
+        self.assertEqual(os.stat(moved).st_ino, inode)
+        os.rename(moved, os.path.join('tests/files', TEST_FILE_LIST[0]))
+        self.teardown()
+
+    def test_folder_copy_is_independent(self):
+        """Tests copies between folders don't share the source file"""
+        self.setup()
+        source = FolderStorage({'path': 'tests/files'})
+        dest = FolderStorage({'path': 'tests/files/done'})
+        self.assertTrue(dest.copy_from(source, TEST_FILE_LIST[0]))
+        self.assertEqual(dest.read_file(TEST_FILE_LIST[0]), TEST_CONTENT)
+        self.assertNotEqual(os.stat(os.path.join('tests/files', TEST_FILE_LIST[0])).st_ino,
+                            os.stat(os.path.join('tests/files/done', TEST_FILE_LIST[0])).st_ino)
+        self.teardown()
+
+    def test_folder_move_named_files(self):
+        """Tests only the named files are moved from tmp, without listing it"""
+        self.setup()
+        tmp = FolderStorage({'path': 'tests/files/done/tmp'})
+        for file_name in TEST_FILE_LIST:
+            tmp.write_file(file_name, TEST_CONTENT)
+        with patch('os.listdir', side_effect=AssertionError):
+            tmp.move_files(file_names=TEST_FILE_LIST[:2])
+        self.assertEqual(sorted(os.listdir('tests/files/done/tmp')), TEST_FILE_LIST[2:])
+        self.assertEqual(FolderStorage({'path': 'tests/files/done'}).read_file(
+            TEST_FILE_LIST[0]), TEST_CONTENT)
+        self.teardown()
+
+    def test_storage_reused(self):
+        """Tests storages are kept between files and replaced when unhealthy"""
+        storage = tasks.get_storage('tests', 'r')
+        self.assertIs(storage, tasks.get_storage('tests', 'r'))
+        storage.is_connected = MagicMock(return_value=False)
+        self.assertIsNot(storage, tasks.get_storage('tests', 'r'))
+        self.assertIsNot(tasks.get_storage('tests/files', 'r'),
+                         tasks.get_storage('tests', 'r'))
+        tasks.close_storages()
+        self.assertEqual(tasks.thread_storages(), {})
+
+    def test_transfer_files_concurrently(self):
+        """Tests a batch is moved by the worker pool and failures are isolated"""
+        self.setup()
+        workers = settings.TRANSFER_WORKERS
+        settings.TRANSFER_WORKERS = 3
+        try:
+            results = tasks.transfer_files(TEST_FILE_LIST + ['missing.csv'],
+                                           'tests/files', 'tests/files/done', 'True')
+        finally:
+            settings.TRANSFER_WORKERS = workers
+        self.assertListEqual(sorted(results['transferred']), sorted(TEST_FILE_LIST))
+        self.assertListEqual(list(results['failed']), ['missing.csv'])
+        storage = FolderStorage({'path': 'tests/files/done'})
+        self.assertListEqual(sorted(storage.list_dir()), sorted(TEST_FILE_LIST))
+        self.teardown()
+
+    def test_many_transfers_in_flight(self):
+        """Tests a large worker pool has every transfer of a batch in flight"""
+        workers = settings.TRANSFER_WORKERS
+        settings.TRANSFER_WORKERS = 200
+        tasks.EXECUTOR = None
+        try:
+            with patch.object(tasks, 'move_file', side_effect=lambda *args: time.sleep(0.5)):
+                start = time.monotonic()
+                results = tasks.transfer_files([str(i) for i in range(200)],
+                                               'tests/files', 'tests/files/done')
+                elapsed = time.monotonic() - start
+        finally:
+            settings.TRANSFER_WORKERS = workers
+            tasks.get_executor().shutdown()
+            tasks.EXECUTOR = None
+        self.assertEqual(len(results['transferred']), 200)
+        self.assertLess(elapsed, 5)
+
+    def test_move_file_callback_republish(self):
+        """Tests consumed events are republished on the consuming queue"""
+        self.setup()
+        republish_queue = settings.READ_MQ_REPUBLISH_QUEUE
+        settings.READ_MQ_REPUBLISH_QUEUE = 'new_queue'
+        mq = MagicMock()
+        channel = MagicMock()
+        method = MagicMock()
+        try:
+            tasks.move_file_callback(channel, method, None,
+                                     utils.generate_event(TEST_FILE_LIST[0]).encode(),
+                                     mq=mq)
+        finally:
+            settings.READ_MQ_REPUBLISH_QUEUE = republish_queue
+        mq.publish_event.assert_called_once_with(TEST_FILE_LIST[0], queue_name='new_queue')
+        mq.exit.assert_not_called()
+        channel.basic_ack.assert_called_once_with(delivery_tag=method.delivery_tag)
+        os.rename(os.path.join(settings.INGEST_DEST_PATH, TEST_FILE_LIST[0]),
+                  os.path.join('tests/files', TEST_FILE_LIST[0]))
+        self.teardown()
+
     def teardown(self):
         """"Teardown: also tests the folder storage delete function"""
         if os.path.isdir('./tests/files/done'):
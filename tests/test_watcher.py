@@ -0,0 +1,61 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from datatransfer import tasks
+from datatransfer.watcher import FolderWatcher
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify requires Linux')
+class TestFolderWatcher(unittest.TestCase):
+    def setup(self):
+        self.path = tempfile.mkdtemp()
+        self.other = tempfile.mkdtemp()
+        self.watcher = FolderWatcher(self.path)
+
+    def teardown(self):
+        self.watcher.exit()
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.other)
+
+    def test_ready_files(self):
+        self.setup()
+        self.assertEqual(self.watcher.wait(0), [])
+        partial = open(os.path.join(self.path, 'partial'), 'wb')
+        partial.write(b'aaa')
+        with open(os.path.join(self.path, 'written'), 'wb') as file:
+            file.write(b'aaa')
+        with open(os.path.join(self.other, 'moved'), 'wb') as file:
+            file.write(b'aaa')
+        os.rename(os.path.join(self.other, 'moved'), os.path.join(self.path, 'moved'))
+        os.mkdir(os.path.join(self.path, 'folder'))
+        self.assertEqual(self.watcher.wait(1), ['written', 'moved'])
+        partial.close()
+        self.assertEqual(self.watcher.wait(1), ['partial'])
+        self.teardown()
+
+    def test_watch_files(self):
+        self.setup()
+        with open(os.path.join(self.path, 'existing'), 'wb') as file:
+            file.write(b'aaa')
+
+        def wait(timeout):
+            with open(os.path.join(self.path, 'new'), 'wb') as file:
+                file.write(b'bbb')
+            return FolderWatcher.wait(self.watcher, timeout)
+
+        with patch('datatransfer.watcher.FolderWatcher', return_value=self.watcher), \
+                patch.object(self.watcher, 'wait', side_effect=wait), \
+                patch.object(self.watcher, 'exit'), \
+                patch.object(tasks, 'process_files', wraps=tasks.process_files) as process:
+            tasks.watch_files(self.path, self.other, 'False', iterations=1)
+        self.assertEqual(sorted(os.listdir(self.other)), ['existing', 'new', 'tmp'])
+        self.assertEqual(process.call_args.kwargs['files'], ['new'])
+        self.teardown()
+
+
+if __name__ == "__main__":
+    unittest.main()